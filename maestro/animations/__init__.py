@@ -1,27 +1,140 @@
-from .bouncing_ball import BouncingBall
-from .bouncing_balls import BouncingBalls
-from .fade_sequence import FadeSequence
-from .fire import Fire
-from .police import Police
-from .sparkle import Sparkle
-
-animations = [
-    BouncingBall,
-    BouncingBalls,
-    FadeSequence,
-    Fire,
-    Police,
-    Sparkle,
-]
+"""The animation registry.
+
+Animations are registered by name and only imported the first time they are
+used. Names are matched case insensitively and ignoring underscores, so
+"BouncingBall", "bouncingball" and "bouncing_ball" are all the same
+animation.
+
+As well as the bundled animations, animations can be added by:
+
+* Installing a package that declares them as entry points in the
+  "maestro.animations" group, e.g. "my_animation = my_package:MyAnimation".
+* Placing them in a plugin directory. Each .py file in the directory is
+  expected to contain one animation class with the file name in CamelCase,
+  e.g. "my_animation.py" containing "class MyAnimation(AnimationInterface)".
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+from importlib import metadata
+
+ENTRY_POINT_GROUP = "maestro.animations"
+
+# Class name: module
+BUNDLED = {
+    "BouncingBall": ".bouncing_ball",
+    "BouncingBalls": ".bouncing_balls",
+    "FadeSequence": ".fade_sequence",
+    "Fire": ".fire",
+    "Police": ".police",
+    "Replay": ".replay",
+    "Sparkle": ".sparkle",
+}
+
+
+class _Entry:
+    def __init__(self, name, load):
+        self.name = name
+        self._load = load
+        self._animation = None
+
+    def resolve(self):
+        if self._animation is None:
+            self._animation = self._load()
+        return self._animation
+
+
+_registry = {}
+
+
+def _key(animation_name):
+    return animation_name.lower().replace("_", "")
+
+
+def register(animation_name, load):
+    """Register an animation. load is a callable that returns the animation
+    class and is called the first time the animation is used. Registering a
+    name that already exists replaces the existing animation.
+    """
+    _registry[_key(animation_name)] = _Entry(animation_name, load)
 
 
 def get(animation_name):
-    """Return an animation class definition where the class name matches the
-    declared value. Matches are case insensitive.
+    """Return an animation class definition where the registered name matches
+    the declared value. Matches are case insensitive and ignore underscores.
 
     Raises a ValueError if no match found.
     """
-    for animation in animations:
-        if animation.__name__.lower() == animation_name.lower():
-            return animation
-    raise ValueError(f"Unknown animation '{animation_name}'")
+    entry = _registry.get(_key(animation_name))
+    if entry is None:
+        raise ValueError(f"Unknown animation '{animation_name}'")
+    return entry.resolve()
+
+
+def names():
+    """Return the names of every registered animation."""
+    return [entry.name for entry in _registry.values()]
+
+
+def _import_bundled(module, class_name):
+    return lambda: getattr(
+        importlib.import_module(module, __name__), class_name
+    )
+
+
+def _import_plugin(path, module_name, class_name):
+    def load():
+        spec = importlib.util.spec_from_file_location(
+            f"maestro_plugins.{module_name}", path
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        return getattr(module, class_name)
+
+    return load
+
+
+def _entry_points():
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=ENTRY_POINT_GROUP)
+    return entry_points.get(ENTRY_POINT_GROUP, [])
+
+
+def discover_plugins(plugin_dir=None):
+    """Register the animations declared as entry points and, if given, those
+    in a plugin directory. Nothing is imported until an animation is used.
+    """
+    for entry_point in _entry_points():
+        register(entry_point.name, entry_point.load)
+
+    if plugin_dir is not None:
+        for file_name in sorted(os.listdir(plugin_dir)):
+            module_name, ext = os.path.splitext(file_name)
+            if ext != ".py" or module_name.startswith("_"):
+                continue
+            class_name = "".join(
+                part.capitalize() for part in module_name.split("_")
+            )
+            register(
+                module_name,
+                _import_plugin(
+                    os.path.join(plugin_dir, file_name),
+                    module_name,
+                    class_name,
+                ),
+            )
+
+
+def __getattr__(name):
+    # The full list of animation classes, which imports every animation
+    if name == "animations":
+        return [entry.resolve() for entry in _registry.values()]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+for class_name, module in BUNDLED.items():
+    register(class_name, _import_bundled(module, class_name))
@@ -1,15 +1,83 @@
+import copy
+import functools
+import json
 import typing
 
 from light import Light
 
+# Values in animation configs that are per frame (e.g. speeds) are per frame
+# at this fps, so animations look the same whatever fps they are run at
+REFERENCE_FPS = 30
+
+
+@functools.lru_cache(maxsize=256)
+def _load_config(config_schema, config_json):
+    return config_schema.load(json.loads(config_json))
+
 
 class AnimationInterface:
+    config_schema = None
+    # Whether rendering is CPU heavy enough to be worth doing in a render
+    # process, see workers.py
+    cpu_heavy = False
+
     def __init__(self, light: Light, config: typing.Dict):
         pass
 
     def set_next_frame(self):
         return True
 
+    def advance(self, elapsed):
+        """Render the frame elapsed seconds after the previous one. Returns
+        True when the animation has finished.
+
+        This is how animations are run. By default it ignores elapsed and
+        calls set_next_frame(), so each frame is a fixed step.
+        """
+        return self.set_next_frame()
+
+    def stop(self):
+        """Called once the animation is no longer running, whether it
+        finished, failed or was stopped, to release anything it holds.
+        """
+
+    def cache_state(self):
+        return None
+
+    @classmethod
+    def load_config(cls, config: typing.Dict):
+        """Validate a config dict using the class's config_schema.
+
+        Validated configs are memoised on the raw config, so repeatedly
+        starting an animation with the same config skips validation. Each
+        call returns a copy, which the caller is free to modify.
+        """
+        config_json = json.dumps(config, sort_keys=True)
+        return copy.deepcopy(_load_config(cls.config_schema, config_json))
+
     @property
     def name(self):
         return self.__class__.__name__
+
+
+class TimeBasedAnimation(AnimationInterface):
+    """An animation that advances by the time elapsed since its last frame,
+    so it runs at the same speed whatever the fps, including when frames are
+    dropped or the fps is lowered under load. Implement advance() rather
+    than set_next_frame().
+    """
+
+    def set_next_frame(self):
+        return self.advance(1 / self.light.animation_fps)
+
+    def advance(self, elapsed):
+        return True
+
+    @staticmethod
+    def steps(elapsed, carry):
+        """Split the time elapsed into whole steps at REFERENCE_FPS, for
+        animations that are simulated in fixed steps. Returns the number of
+        steps and the fraction of a step to carry over to the next frame.
+        """
+        steps, carry = divmod(carry + elapsed * REFERENCE_FPS, 1)
+        return int(steps), carry
@@ -3,7 +3,7 @@ import typing
 from light import Light
 from marshmallow import Schema, fields, post_load, validate
 
-from .animation_interface import AnimationInterface
+from .animation_interface import REFERENCE_FPS, TimeBasedAnimation
 
 
 class BouncingBallConfig:
@@ -49,11 +49,18 @@ class BouncingBallConfigSchema(Schema):
         return BouncingBallConfig(**data)
 
 
-class BouncingBall(AnimationInterface):
+class BouncingBall(TimeBasedAnimation):
+    """A ball dropped from a height, bouncing until it comes to rest.
+
+    gravity (the change in speed) and terminal_velocity are in LEDs per frame
+    at REFERENCE_FPS.
+    """
+
+    config_schema = BouncingBallConfigSchema()
+
     def __init__(self, light: Light, config: typing.Dict, clear_light=True):
         self.light = light
-        config_schema = BouncingBallConfigSchema()
-        self.config = config_schema.load(config)
+        self.config = self.load_config(config)
         self.clear_light = clear_light
 
         if (
@@ -73,33 +80,38 @@ class BouncingBall(AnimationInterface):
         self._cur_height = self.config.starting_height
         self._finished = False
 
-    def adjust_acceleration(self):
+    def adjust_acceleration(self, steps=1):
         # Falling
         if self._falling is True:
             self._cur_speed = min(
                 self.config.terminal_velocity,
-                self._cur_speed + self.config.gravity,
+                self._cur_speed + self.config.gravity * steps,
             )
         # Going up
         else:
-            self._cur_speed = max(0, self._cur_speed - self.config.gravity)
+            self._cur_speed = max(
+                0, self._cur_speed - self.config.gravity * steps
+            )
             if self._cur_speed == 0:
                 self._falling = True
                 if self._cur_height_round == 0:
                     self._finished = True
 
-    def set_new_position(self):
+    def set_new_position(self, steps=1):
         # Falling
         if self._falling is True:
-            self._cur_height -= self._cur_speed
+            self._cur_height -= self._cur_speed * steps
             if self._cur_height <= 0:
                 self._cur_height = 0
                 self._falling = False
                 self._cur_speed = self._cur_speed * self.config.bounciness
         # Going up
         else:
-            self._cur_height += self._cur_speed
-            # TODO: Do I need a limit here?
+            # Long steps can overshoot, so keep the ball on the light
+            self._cur_height = min(
+                self._cur_height + self._cur_speed * steps,
+                self.light.max_index,
+            )
 
     @property
     def _cur_height_round(self):
@@ -151,9 +163,11 @@ class BouncingBall(AnimationInterface):
                         cur_trail_led, self.config.colour, brightness
                     )
 
-    def set_next_frame(self):
-        self.set_new_position()
-        self.adjust_acceleration()
+    def advance(self, elapsed):
+        # Steps (frames at REFERENCE_FPS) elapsed, which can be fractional
+        steps = elapsed * REFERENCE_FPS
+        self.set_new_position(steps)
+        self.adjust_acceleration(steps)
         self.add_ball_to_light()
         self.add_trail_to_light()
         return self._finished
@@ -3,7 +3,7 @@ import typing
 from light import Light
 from marshmallow import Schema, fields, post_load, validate
 
-from .animation_interface import AnimationInterface
+from .animation_interface import TimeBasedAnimation
 from .bouncing_ball import BouncingBall
 
 
@@ -28,11 +28,13 @@ class BouncingBallsConfigSchema(Schema):
         return BouncingBallsConfig(**data)
 
 
-class BouncingBalls(AnimationInterface):
+class BouncingBalls(TimeBasedAnimation):
+    config_schema = BouncingBallsConfigSchema()
+    cpu_heavy = True
+
     def __init__(self, light: Light, config: typing.Dict):
         self.light = light
-        config_schema = BouncingBallsConfigSchema()
-        self.config = config_schema.load(config)
+        self.config = self.load_config(config)
 
         self.balls = []
         for ball_config in self.config.balls:
@@ -40,11 +42,11 @@ class BouncingBalls(AnimationInterface):
                 BouncingBall(self.light, ball_config, clear_light=False)
             )
 
-    def set_next_frame(self):
+    def advance(self, elapsed):
         self.light.clear_leds()
         all_finished = True
         for ball in self.balls:
-            ball_finished = ball.set_next_frame()
+            ball_finished = ball.advance(elapsed)
             if ball_finished is False:
                 all_finished = False
         return all_finished
@@ -1,15 +1,18 @@
 import typing
 
+import palettes
 from light import Light
 from marshmallow import Schema, fields, post_load, validate
+from palettes import PaletteField
 
-from .animation_interface import AnimationInterface
+from .animation_interface import REFERENCE_FPS, TimeBasedAnimation
 
 
 class FadeSequenceConfig:
-    def __init__(self, sequence, target_rgb, speed, clear_first):
+    def __init__(self, sequence, target_rgb, palette, speed, clear_first):
         self.sequence = sequence
         self.target_rgb = target_rgb
+        self.palette = palette
         self.speed = speed
         self.clear_first = clear_first
 
@@ -25,6 +28,8 @@ class FadeSequenceConfigSchema(Schema):
         validate=validate.Length(equal=3),
         missing=[255, 255, 255],
     )
+    # If set, the LEDs fade to colours along the palette instead
+    palette = PaletteField(missing=None)
     speed = fields.Int(validate=validate.Range(min=1), missing=20)
     clear_first = fields.Boolean(missing=True)
 
@@ -33,41 +38,71 @@ class FadeSequenceConfigSchema(Schema):
         return FadeSequenceConfig(**data)
 
 
-class FadeSequence(AnimationInterface):
+class FadeSequence(TimeBasedAnimation):
+    """Fades each LED in a sequence to a colour in turn. speed is the change
+    in each channel per frame at REFERENCE_FPS. With a palette, the colours
+    are spread along the palette in the order of the sequence.
+    """
+
+    config_schema = FadeSequenceConfigSchema()
+
     def __init__(self, light: Light, config: typing.Dict):
         self.light = light
-        config_schema = FadeSequenceConfigSchema()
-        self.config = config_schema.load(config)
+        self.config = self.load_config(config)
 
         # Drop any indexes out of range
         self.config.sequence = [
             idx for idx in self.config.sequence if idx <= light.max_index
         ]
+        if not self.config.sequence:
+            raise ValueError(
+                "Every LED in the sequence is out of range (the light has "
+                f"{light.num_leds} LEDs)"
+            )
+
+        # The colour each step of the sequence fades to
+        if self.config.palette is None:
+            self._targets = [self.config.target_rgb] * len(
+                self.config.sequence
+            )
+        else:
+            palette = palettes.get(self.config.palette)
+            count = len(self.config.sequence)
+            self._targets = [
+                palette.colour(step * palettes.SIZE // count)
+                for step in range(count)
+            ]
 
         self._step = 0
         self._cleared = False
+        # Change in each channel available to this frame. Whatever isn't
+        # used fading one LED carries on to the next.
+        self._budget = 0
 
-    def set_next_frame(self):
+    def advance(self, elapsed):
         if self._cleared is False and self.config.clear_first is True:
             self.light.clear_leds()
             self._cleared = True
 
-        led_idx = self.config.sequence[self._step]
-        cur_rgb = self.light._state[led_idx].copy()
-        for col_idx, col in enumerate(cur_rgb):
-            if col > self.config.target_rgb[col_idx]:
-                cur_rgb[col_idx] = max(
-                    [col - self.config.speed, self.config.target_rgb[col_idx]]
-                )
-            elif col < self.config.target_rgb[col_idx]:
-                cur_rgb[col_idx] = min(
-                    [col + self.config.speed, self.config.target_rgb[col_idx]]
-                )
-        self.light.set_led(led_idx, cur_rgb)
-
-        if cur_rgb == self.config.target_rgb:
+        self._budget += self.config.speed * elapsed * REFERENCE_FPS
+        while True:
+            led_idx = self.config.sequence[self._step]
+            target_rgb = self._targets[self._step]
+            cur_rgb = self.light.get_led(led_idx)
+            distance = max(
+                abs(target - col) for col, target in zip(cur_rgb, target_rgb)
+            )
+            change = min(int(self._budget), distance)
+            for col_idx, col in enumerate(cur_rgb):
+                if col > target_rgb[col_idx]:
+                    cur_rgb[col_idx] = max([col - change, target_rgb[col_idx]])
+                elif col < target_rgb[col_idx]:
+                    cur_rgb[col_idx] = min([col + change, target_rgb[col_idx]])
+            self.light.set_led(led_idx, cur_rgb)
+            self._budget -= change
+
+            if cur_rgb != target_rgb:
+                return False
             self._step += 1
             if self._step > len(self.config.sequence) - 1:
                 return True
-
-        return False
@@ -4,81 +4,132 @@ Ported to Python from this source:
 https://www.tweaking4all.com/hardware/arduino/adruino-led-strip-effects/#LEDStripEffectFire
 
 Original comments and variable names maintained.
+
+The fire is simulated in steps at REFERENCE_FPS, however often frames are
+rendered. If NumPy is installed, each step is run as an array operation over
+the whole strip. Otherwise a pure Python implementation is used.
+
+Heat is shown as colour through a palette (see palettes.py), the classic heat
+palette by default.
 """
 
 import random
 import typing
 
+import palettes
 from light import Light
 from marshmallow import Schema, fields, post_load, validate
+from palettes import PaletteField
 
-from .animation_interface import AnimationInterface
+from .animation_interface import TimeBasedAnimation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class FireConfig:
-    def __init__(self, cooling, sparking):
+    def __init__(self, cooling, sparking, palette):
         self.cooling = cooling
         self.sparking = sparking
+        self.palette = palette
 
 
 class FireConfigSchema(Schema):
     cooling = fields.Int(validate=validate.Range(min=1), missing=55)
     sparking = fields.Int(validate=validate.Range(min=1), missing=120)
+    palette = PaletteField(missing="heat")
 
     @post_load
     def make_config(self, data, **kwargs):
         return FireConfig(**data)
 
 
-class Fire(AnimationInterface):
+class Fire(TimeBasedAnimation):
+    config_schema = FireConfigSchema()
+    cpu_heavy = True
+
     def __init__(self, light: Light, config: typing.Dict):
         self.light = light
-        config_schema = FireConfigSchema()
-        self.config = config_schema.load(config)
+        self.config = self.load_config(config)
+
+        # Exclusive upper bound of the random cooldown applied to each cell
+        self._max_cooldown = (
+            (self.config.cooling * 10) // self.light.num_leds
+        ) + 2
+        # Heat (0-255) to colour
+        self._palette = palettes.get(self.config.palette)
+
+        # The heat of each cell carries over from one frame to the next
+        if numpy is not None:
+            self._rng = numpy.random.default_rng()
+            self._heat = numpy.zeros(self.light.num_leds, dtype=numpy.int16)
+            self._frame = numpy.frombuffer(
+                self.light.pixels, dtype=numpy.uint8
+            ).reshape(-1, 3)
+        else:
+            self._heat = [0] * self.light.num_leds
+        # Fraction of a step carried over to the next frame. The first frame
+        # is always a step.
+        self._carry = 1
+
+    def _spark(self):
+        # Step 3.  Randomly ignite new 'sparks' near the bottom
+        if random.randrange(255) < self.config.sparking:
+            y = random.randrange(min(7, self.light.num_leds))
+            self._heat[y] = min(
+                255, self._heat[y] + random.randrange(160, 255)
+            )
 
-    def _set_pixel_heat_colour(self, led, temperature, light):
-        # Scale 'heat' down from 0-255 to 0-191
-        t192 = round((temperature / 255) * 191)
+    def _step_numpy(self):
+        heat = self._heat
 
-        # calculate ramp up from
-        heatramp = t192 & 63
-        heatramp <<= 2  # scale up to 0..252
+        # Step 1.  Cool down every cell a little
+        heat -= self._rng.integers(
+            0, self._max_cooldown, size=heat.size, dtype=numpy.int16
+        )
+        numpy.maximum(heat, 0, out=heat)
 
-        # figure out which third of the spectrum we're in:
-        if t192 > 128:  # hottest
-            light.set_led(led, [255, 255, heatramp])
-        elif t192 > 64:  # middle
-            light.set_led(led, [255, heatramp, 0])
-        else:  # coolest
-            light.set_led(led, [heatramp, 0, 0])
+        # Step 2.  Heat from each cell drifts 'up' and diffuses a little
+        heat[2:] = (heat[1:-1] + heat[:-2] + heat[:-2]) // 3
 
-    def set_next_frame(self):
-        heat = [0 for led in range(self.light.num_leds)]
+        self._spark()
 
-        # Step 1.  Cool down every cell a little
-        for i in range(self.light.num_leds):
-            cooldown = random.uniform(
-                0, ((self.config.cooling * 10) / self.light.num_leds) + 2
-            )
+    def _draw_numpy(self):
+        # Step 4.  Convert heat to LED colors
+        numpy.take(self._palette.array, self._heat, axis=0, out=self._frame)
 
-            if cooldown > heat[i]:
-                heat[i] = 0
-            else:
-                heat[i] -= cooldown
+    def _step_python(self):
+        heat = self._heat
+
+        # Step 1.  Cool down every cell a little
+        heat = [max(0, h - random.randrange(self._max_cooldown)) for h in heat]
 
         # Step 2.  Heat from each cell drifts 'up' and diffuses a little
-        k = self.light.num_leds - 1
-        while k >= 2:
-            heat[k] = (heat[k - 1] + heat[k - 2] + heat[k - 2]) / 3
-            k -= 1
+        heat[2:] = [
+            (heat[k - 1] + heat[k - 2] + heat[k - 2]) // 3
+            for k in range(2, len(heat))
+        ]
 
-        # Step 3.  Randomly ignite new 'sparks' near the bottom
-        if random.randint(0, 255) < self.config.sparking:
-            y = random.randint(0, 7)
-            heat[y] += random.randint(160, 255)
+        self._heat = heat
+        self._spark()
 
+    def _draw_python(self):
         # Step 4.  Convert heat to LED colors
-        for j in range(self.light.num_leds):
-            self._set_pixel_heat_colour(j, heat[j], self.light)
-
+        self.light.set_palette_indices(bytes(self._heat), self._palette)
+
+    def advance(self, elapsed):
+        steps, self._carry = self.steps(elapsed, self._carry)
+        if steps == 0:
+            return False
+        if numpy is not None:
+            for _ in range(steps):
+                self._step_numpy()
+            self._draw_numpy()
+        else:
+            for _ in range(steps):
+                self._step_python()
+            self._draw_python()
+        self.light.mark_dirty()
         return False
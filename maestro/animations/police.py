@@ -9,12 +9,16 @@ Animation Steps:
   7. Bottom   White   Up
   8. Bottom   White   Down
 """
+
 import typing
 
 from light import Light
 from marshmallow import Schema, fields, post_load, validate
 
-from .animation_interface import AnimationInterface
+from .animation_interface import REFERENCE_FPS, TimeBasedAnimation
+
+# Seconds to wait at the end of steps 4 & 8 before flipping the side
+FLIP_WAIT = 0.1
 
 
 class PoliceConfig:
@@ -30,31 +34,32 @@ class PoliceConfigSchema(Schema):
         return PoliceConfig(**data)
 
 
-class Police(AnimationInterface):
+class Police(TimeBasedAnimation):
+    config_schema = PoliceConfigSchema()
+
     def __init__(self, light: Light, config: typing.Dict):
         self.light = light
-        config_schema = PoliceConfigSchema()
-        self.config = config_schema.load(config)
+        self.config = self.load_config(config)
 
         self._col_bri = 1
         self._top_not_bottom = True
         self._blue_not_white = True
         self._bri_up_not_down = True
-        self._frame_wait_count = 0
+        self._waited = 0
 
-    def set_next_frame(self):
+    def advance(self, elapsed):
         # Flip the side at the end of steps 4 & 8
         if (
             self._col_bri == 0
             and self._blue_not_white is False
             and self._bri_up_not_down is False
         ):
-            if self._frame_wait_count <= round(self.light.animation_fps / 10):
-                self._frame_wait_count += 1
+            if self._waited < FLIP_WAIT:
+                self._waited += elapsed
                 return
             else:
                 self._top_not_bottom = not self._top_not_bottom
-                self._frame_wait_count = 0
+                self._waited = 0
 
         # Change brightness direction at edges
         if self._col_bri == 255:
@@ -66,8 +71,7 @@ class Police(AnimationInterface):
 
         # Calculate the next colour brightness
         col_bri_step = round(
-            (90 * self.config.speed_multiplier)
-            * (30 / self.light.animation_fps)
+            (90 * self.config.speed_multiplier) * (elapsed * REFERENCE_FPS)
         )
         if self._bri_up_not_down is True:
             self._col_bri += col_bri_step
@@ -92,3 +96,14 @@ class Police(AnimationInterface):
             self.light.set_percentage(50, [0, 0, 0], target_col)
         else:
             self.light.set_percentage(50, target_col)
+
+    def cache_state(self):
+        # Police loops forever and every frame is determined by this state,
+        # so its frames can be cached
+        return (
+            self._col_bri,
+            self._top_not_bottom,
+            self._blue_not_white,
+            self._bri_up_not_down,
+            self._waited,
+        )
@@ -0,0 +1,66 @@
+import typing
+
+from light import Light
+from marshmallow import Schema, fields, post_load
+from recording import Recording
+
+from .animation_interface import TimeBasedAnimation
+
+
+class ReplayConfig:
+    def __init__(self, path, loop):
+        self.path = path
+        self.loop = loop
+
+
+class ReplayConfigSchema(Schema):
+    path = fields.String(required=True)
+    loop = fields.Boolean(missing=False)
+
+    @post_load
+    def make_config(self, data, **kwargs):
+        return ReplayConfig(**data)
+
+
+class Replay(TimeBasedAnimation):
+    """Plays back a frame file written by recording.py. Frames are played at
+    the fps they were recorded at, whatever the light's animation_fps.
+    """
+
+    config_schema = ReplayConfigSchema()
+
+    def __init__(self, light: Light, config: typing.Dict):
+        self.light = light
+        self.config = self.load_config(config)
+
+        self.recording = Recording(self.config.path)
+        if self.recording.num_leds != self.light.num_leds:
+            self.recording.close()
+            raise ValueError(
+                f"'{self.config.path}' was recorded for "
+                f"{self.recording.num_leds} LEDs, not {self.light.num_leds}"
+            )
+
+        # Position in the recording, in frames
+        self._position = None
+
+    def advance(self, elapsed):
+        frame_count = self.recording.frame_count
+        if frame_count == 0:
+            return True
+
+        if self._position is None:
+            self._position = 0
+        else:
+            self._position += elapsed * self.recording.fps
+        if self._position >= frame_count:
+            if self.config.loop is False:
+                return True
+            self._position %= frame_count
+        frame = int(self._position)
+
+        self.light.set_pixels(self.recording.frame(frame))
+        return self.config.loop is False and frame == frame_count - 1
+
+    def stop(self):
+        self.recording.close()
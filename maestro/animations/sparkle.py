@@ -4,7 +4,7 @@ import typing
 from light import Light
 from marshmallow import Schema, fields, post_load, validate
 
-from .animation_interface import AnimationInterface
+from .animation_interface import TimeBasedAnimation
 
 
 class SparkleConfig:
@@ -24,13 +24,22 @@ class SparkleConfigSchema(Schema):
         return SparkleConfig(**data)
 
 
-class Sparkle(AnimationInterface):
+class Sparkle(TimeBasedAnimation):
+    """A single random LED lit at a time, moving REFERENCE_FPS times a
+    second.
+    """
+
+    config_schema = SparkleConfigSchema()
+
     def __init__(self, light: Light, config: typing.Dict):
         self.light = light
-        config_schema = SparkleConfigSchema()
-        self.config = config_schema.load(config)
+        self.config = self.load_config(config)
+        self._carry = 1
 
-    def set_next_frame(self):
+    def advance(self, elapsed):
+        steps, self._carry = self.steps(elapsed, self._carry)
+        if steps == 0:
+            return False
         self.light.clear_leds()
         rand_led_i = random.randint(0, self.light.max_index)
         self.light.set_led(rand_led_i, self.config.rgb)
@@ -0,0 +1,222 @@
+"""Headless benchmark of every registered animation.
+
+Each animation is run for a number of frames against lights of several sizes,
+with frames sent to a null sink rather than the network. Results are written
+as JSON so runs can be compared, e.g.
+
+    python benchmark.py --output before.json
+    python benchmark.py --compare before.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import animations
+import recording
+from light import Light, NullSink
+
+DEFAULT_SIZES = [60, 300, 1000, 5000]
+DEFAULT_FRAMES = 300
+START_REPEATS = 50
+
+# Configs for animations with required config values. Everything else runs
+# with its schema defaults.
+REQUIRED_CONFIG = {
+    "FadeSequence": lambda num_leds: {"sequence": list(range(num_leds))},
+    "Replay": lambda num_leds: {"path": _replay_recording(num_leds)},
+}
+
+# Metrics where a higher value is a regression, used by --compare
+COMPARED_METRICS = [
+    "start_time_mean",
+    "frame_time_mean",
+    "frame_time_p99",
+    "bytes_per_frame",
+]
+
+
+def _replay_recording(num_leds):
+    """Return the path of a recording of BouncingBalls for the Replay
+    animation to play back, recording it on first use.
+    """
+    if num_leds not in _replay_recordings:
+        path = os.path.join(_replay_dir.name, f"{num_leds}.frames")
+        recording.record(
+            animations.get("bouncingballs"), {}, num_leds, 30, path
+        )
+        _replay_recordings[num_leds] = path
+    return _replay_recordings[num_leds]
+
+
+_replay_dir = tempfile.TemporaryDirectory()
+_replay_recordings = {}
+
+
+def _config_for(animation_cls, num_leds):
+    make_config = REQUIRED_CONFIG.get(animation_cls.__name__)
+    return make_config(num_leds) if make_config is not None else {}
+
+
+def _run_frames(animation_cls, config, light, frames, frame_times=None):
+    """Render and send a number of frames, starting a new instance of the
+    animation whenever one finishes.
+    """
+    animation = animation_cls(light, config)
+    elapsed = 1 / light.animation_fps
+    for _ in range(frames):
+        started = time.perf_counter()
+        finished = animation.advance(elapsed)
+        if frame_times is not None:
+            frame_times.append(time.perf_counter() - started)
+        light.update()
+        if finished is True:
+            animation = animation_cls(light, config)
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    idx = max(0, math.ceil(len(ordered) * percentile / 100) - 1)
+    return ordered[idx]
+
+
+def benchmark(animation_cls, num_leds, frames):
+    """Benchmark a single animation on a light with the given number of LEDs
+    and return the results as a dict. Times are in seconds.
+    """
+    config = _config_for(animation_cls, num_leds)
+
+    # Timed run
+    random.seed(0)
+    sink = NullSink()
+    light = Light("0.0.0.0", 0, num_leds, sock=sink)
+    frame_times = []
+    started = time.perf_counter()
+    _run_frames(animation_cls, config, light, frames, frame_times)
+    elapsed = time.perf_counter() - started
+
+    # Start latency, i.e. the time taken to create the animation
+    started = time.perf_counter()
+    for _ in range(START_REPEATS):
+        animation_cls(light, config)
+    start_time = (time.perf_counter() - started) / START_REPEATS
+
+    # Allocation run, separate as tracing slows everything down
+    random.seed(0)
+    light = Light("0.0.0.0", 0, num_leds, sock=NullSink())
+    tracemalloc.start()
+    _run_frames(animation_cls, config, light, frames)
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "animation": animation_cls.__name__,
+        "num_leds": num_leds,
+        "frames": frames,
+        "start_time_mean": start_time,
+        "fps": frames / elapsed,
+        "frame_time_mean": sum(frame_times) / frames,
+        "frame_time_p99": _percentile(frame_times, 99),
+        "bytes_per_frame": sink.bytes / frames,
+        "packets_per_frame": sink.packets / frames,
+        "peak_alloc_bytes": peak_alloc,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a description of every metric that is worse than the baseline
+    by more than the threshold (a fraction).
+    """
+    baseline_results = {
+        (result["animation"], result["num_leds"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        key = (result["animation"], result["num_leds"])
+        if key not in baseline_results:
+            continue
+        for metric in COMPARED_METRICS:
+            before = baseline_results[key][metric]
+            after = result[metric]
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append(
+                    f"{key[0]} ({key[1]} LEDs) {metric}: "
+                    f"{before:.6g} -> {after:.6g}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, metavar="N"
+    )
+    parser.add_argument(
+        "--animation",
+        action="append",
+        help="Only benchmark this animation. Can be given more than once.",
+    )
+    parser.add_argument("--output", help="Write the JSON results to a file.")
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="Compare with a previous JSON output and exit with status 1 if "
+        "any metric regressed.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Fractional increase counted as a regression (default 0.1).",
+    )
+    args = parser.parse_args()
+
+    selected = animations.animations
+    if args.animation:
+        selected = [animations.get(name) for name in args.animation]
+
+    results = []
+    for animation_cls in selected:
+        for num_leds in args.sizes:
+            result = benchmark(animation_cls, num_leds, args.frames)
+            results.append(result)
+            print(
+                f"{result['animation']:<15} {num_leds:>6} LEDs "
+                f"{result['start_time_mean'] * 1000:>8.3f} ms start "
+                f"{result['fps']:>10.1f} fps "
+                f"{result['frame_time_p99'] * 1000:>8.3f} ms p99 "
+                f"{result['bytes_per_frame']:>9.1f} B/frame",
+                file=sys.stderr,
+            )
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
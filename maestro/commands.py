@@ -0,0 +1,150 @@
+import queue
+import time
+from threading import Lock, Thread
+
+from logger import log
+from metrics import Histogram
+
+
+class Command:
+    """A command for a light, as received and before any parsing of its
+    payload.
+
+    Commands for the same light and slot supersede each other, e.g. a light
+    can only end up in one state, so of several pending on/off/start commands
+    only the latest needs handling. Commands without a slot are all handled.
+    """
+
+    __slots__ = (
+        "light_name",
+        "instruction",
+        "handler",
+        "slot",
+        "payload",
+        "received",
+    )
+
+    def __init__(self, light_name, instruction, handler, slot, payload):
+        self.light_name = light_name
+        self.instruction = instruction
+        self.handler = handler
+        self.slot = slot
+        self.payload = payload
+        self.received = time.monotonic()
+
+
+class Route:
+    """Where messages on a particular topic are routed to: the light they are
+    for, the handler for the instruction and the command slot it occupies.
+    """
+
+    __slots__ = ("light_name", "instruction", "handler", "slot")
+
+    def __init__(self, light_name, instruction, handler, slot):
+        self.light_name = light_name
+        self.instruction = instruction
+        self.handler = handler
+        self.slot = slot
+
+    def command(self, payload):
+        return Command(
+            self.light_name, self.instruction, self.handler, self.slot, payload
+        )
+
+
+class CommandQueue:
+    """Per-light, latest-wins queues of commands, drained by worker threads.
+
+    Each light has one pending command per slot. A command replaces (and
+    coalesces) any pending command in the same slot, so superseded commands
+    are dropped before any work is done on them. A light's commands are only
+    ever handled by one worker at a time, so they are handled in order.
+    """
+
+    def __init__(self, handler, workers=1):
+        self._handler = handler
+        self._lock = Lock()
+        self._pending = {}
+        # Lights either waiting in _ready or being handled by a worker
+        self._scheduled = set()
+        self._ready = queue.Queue()
+        self._received = {}
+        self._coalesced = {}
+        self._handled = {}
+        self._latency = {}
+
+        for _ in range(workers):
+            Thread(target=self._work, daemon=True).start()
+
+    def put(self, command):
+        light_name = command.light_name
+        slot = command.slot if command.slot is not None else object()
+        with self._lock:
+            slots = self._pending.setdefault(light_name, {})
+            # The replacement is handled in the order it arrived, after any
+            # commands received since the one it replaces
+            if slots.pop(slot, None) is not None:
+                self._coalesced[light_name] = (
+                    self._coalesced.get(light_name, 0) + 1
+                )
+            slots[slot] = command
+            self._received[light_name] = self._received.get(light_name, 0) + 1
+            if light_name not in self._scheduled:
+                self._scheduled.add(light_name)
+                self._ready.put(light_name)
+
+    def _work(self):
+        while True:
+            light_name = self._ready.get()
+            with self._lock:
+                commands = self._pending.pop(light_name, {})
+
+            for command in commands.values():
+                try:
+                    self._handler(command)
+                except Exception:
+                    log.exception(
+                        f"Failed to handle '{command.instruction}' for "
+                        f"'{light_name}'"
+                    )
+                latency = self._latency.get(light_name)
+                if latency is None:
+                    latency = self._latency.setdefault(light_name, Histogram())
+                latency.observe(time.monotonic() - command.received)
+
+            with self._lock:
+                self._handled[light_name] = self._handled.get(
+                    light_name, 0
+                ) + len(commands)
+                if light_name in self._pending:
+                    self._ready.put(light_name)
+                else:
+                    self._scheduled.discard(light_name)
+
+    def metrics(self):
+        """Return the queue depth (pending commands) and the number of
+        commands received, coalesced and handled, per light and in total,
+        and a histogram of the latency of each light's commands.
+        """
+        with self._lock:
+            lights = {
+                light_name: {
+                    "depth": len(self._pending.get(light_name, {})),
+                    "received": received,
+                    "coalesced": self._coalesced.get(light_name, 0),
+                    "handled": self._handled.get(light_name, 0),
+                }
+                for light_name, received in self._received.items()
+            }
+        for light_name, light in lights.items():
+            latency = self._latency.get(light_name)
+            light["latency"] = (
+                latency.as_dict()
+                if latency is not None
+                else Histogram().as_dict()
+            )
+        totals = {
+            metric: sum(light[metric] for light in lights.values())
+            for metric in ["depth", "received", "coalesced", "handled"]
+        }
+        return dict(totals, lights=lights)
@@ -0,0 +1,49 @@
+import os
+import threading
+
+from logger import log
+
+
+class ConfigWatcher:
+    """Calls a callback, from a background thread, whenever a file changes.
+
+    The file's modification time and size are checked every interval
+    seconds, which is cheap enough to do often and needs nothing beyond the
+    standard library.
+    """
+
+    def __init__(self, path, interval, callback):
+        self.path = path
+        self.interval = interval
+        self._callback = callback
+        self._stamp = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._stamp = self._read_stamp()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _read_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            stamp = self._read_stamp()
+            if stamp == self._stamp:
+                continue
+            self._stamp = stamp
+            # A missing file is usually one being replaced, so wait for it
+            if stamp is None:
+                continue
+            log.info(f"'{self.path}' changed, reloading")
+            try:
+                self._callback()
+            except Exception:
+                log.exception("Failed to reload config")
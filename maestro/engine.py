@@ -0,0 +1,270 @@
+import heapq
+import itertools
+import math
+import time
+import weakref
+from threading import Condition, Thread
+
+from logger import log
+from transport import Batch
+
+
+class _Job:
+    def __init__(self, light, scheduler, cancelled):
+        self.light = light
+        self.scheduler = scheduler
+        self.cancelled = cancelled
+
+
+class RenderEngine:
+    """Renders the frames of every registered light from a single thread.
+
+    Each light keeps its own frame schedule (and so its own animation_fps) but
+    all schedules are aligned to a shared epoch, so lights running at the same
+    fps are rendered and sent together on the same tick. A light is
+    registered while it has animations to render.
+
+    Where supported, the frames of every light rendered on a tick are sent
+    with a single batched send.
+    """
+
+    def __init__(self, batch_send=True):
+        self.batch_send = batch_send and Batch.supported
+        self._condition = Condition()
+        self._queue = []
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._epoch = time.monotonic()
+        self._thread = None
+
+    def register(self, light, scheduler, cancelled):
+        """Start rendering frames of a light, replacing any registration
+        for that light already. Frames are rendered until the light has
+        nothing left to render or the cancelled event is set.
+        """
+        job = _Job(light, scheduler, cancelled)
+        with self._condition:
+            self._cancel(light)
+            self._jobs[light] = job
+            self._push(scheduler.reset(epoch=self._epoch), job)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, light):
+        """Stop rendering frames of a light. This does not wait for a frame
+        that is already being rendered.
+        """
+        with self._condition:
+            self._cancel(light)
+
+    def is_registered(self, light):
+        with self._condition:
+            return light in self._jobs
+
+    def _cancel(self, light):
+        job = self._jobs.pop(light, None)
+        if job is not None:
+            job.cancelled.set()
+
+    def _push(self, deadline, job):
+        heapq.heappush(self._queue, (deadline, next(self._counter), job))
+
+    def _next_due_jobs(self):
+        """Block until at least one job is due and return every due job.
+        Must be called with the condition held.
+        """
+        while True:
+            while self._queue and self._queue[0][2].cancelled.is_set():
+                heapq.heappop(self._queue)
+            if not self._queue:
+                self._condition.wait()
+                continue
+            now = time.monotonic()
+            if self._queue[0][0] <= now:
+                break
+            self._condition.wait(self._queue[0][0] - now)
+
+        jobs = []
+        while self._queue and self._queue[0][0] <= now:
+            job = heapq.heappop(self._queue)[2]
+            if not job.cancelled.is_set():
+                jobs.append(job)
+        return jobs
+
+    def _run(self):
+        while True:
+            with self._condition:
+                jobs = self._next_due_jobs()
+
+            batch = Batch() if self.batch_send else None
+            results = []
+            for job in jobs:
+                started = job.scheduler.begin_frame()
+                # One light failing mustn't stop the others, so it is dropped
+                try:
+                    finished = job.light._render_frame(job.cancelled, batch)
+                except Exception:
+                    log.exception("Failed to render frame")
+                    finished = True
+                job.scheduler.end_frame(started)
+                results.append((job, finished))
+
+            if batch is not None:
+                try:
+                    batch.send()
+                except Exception:
+                    log.exception("Failed to send frames")
+
+            for job, finished in results:
+                self._finish_frame(job, finished)
+
+    def _finish_frame(self, job, finished):
+        with self._condition:
+            if job.cancelled.is_set():
+                return
+            if finished is False:
+                self._push(job.scheduler.deadline, job)
+                return
+            if self._jobs.get(job.light) is job:
+                del self._jobs[job.light]
+
+
+class Flusher:
+    """Sends lights whose frame buffers are written to by virtual lights.
+
+    A requested light is sent on the next point of a grid of its frame
+    periods (aligned to a shared epoch), so however many of its virtual
+    lights are updated within a frame period, it is sent once. Lights due on
+    the same tick are sent together, batched where supported.
+    """
+
+    def __init__(self, batch_send=True):
+        self.batch_send = batch_send and Batch.supported
+        self._condition = Condition()
+        self._queue = []
+        self._pending = {}
+        self._counter = itertools.count()
+        self._epoch = time.monotonic()
+        self._thread = None
+
+    def request(self, light, force=False):
+        """Request that a light is sent at its next frame. If force is True
+        it is sent even if unchanged.
+        """
+        with self._condition:
+            if light in self._pending:
+                self._pending[light] = self._pending[light] or force
+                return
+            self._pending[light] = force
+
+            period = 1 / light.animation_fps
+            now = time.monotonic()
+            deadline = (
+                self._epoch + math.ceil((now - self._epoch) / period) * period
+            )
+            heapq.heappush(self._queue, (deadline, next(self._counter), light))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    now = time.monotonic()
+                    if self._queue[0][0] <= now:
+                        break
+                    self._condition.wait(self._queue[0][0] - now)
+                due = []
+                while self._queue and self._queue[0][0] <= now:
+                    light = heapq.heappop(self._queue)[2]
+                    due.append((light, self._pending.pop(light)))
+
+            batch = Batch() if self.batch_send else None
+            for light, force in due:
+                try:
+                    light.flush(force, batch)
+                except Exception:
+                    log.exception("Failed to send light")
+            if batch is not None:
+                try:
+                    batch.send()
+                except Exception:
+                    log.exception("Failed to send frames")
+
+
+class KeepaliveTimer:
+    """Resends the frames of idle lights as a keepalive.
+
+    While an animation runs, the render loop resends an unchanged frame every
+    keepalive seconds. Once it stops, e.g. after on() or off() or when an
+    animation finishes, nothing else would, and the controller would return
+    to normal operation after its timeout. Lights with a timeout register
+    here, and those not animating are flushed whenever their keepalive is
+    due.
+    """
+
+    # Longest wait between checks, so changes to a light's keepalive are
+    # picked up
+    MAX_WAIT = 1
+
+    def __init__(self):
+        self._condition = Condition()
+        # Lights that are no longer used are dropped
+        self._lights = weakref.WeakSet()
+        self._thread = None
+
+    def register(self, light):
+        with self._condition:
+            self._lights.add(light)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, light):
+        with self._condition:
+            self._lights.discard(light)
+
+    def _due(self, now):
+        """Return the idle lights due a keepalive, and the seconds until the
+        next one is.
+        """
+        due = []
+        wait = self.MAX_WAIT
+        for light in list(self._lights):
+            last_send_time = light._last_send_time
+            if (
+                light.timeout == 255
+                or last_send_time is None
+                or light.animating
+            ):
+                continue
+            # A light that sends every frame is resent every frame period
+            interval = light.keepalive or 1 / light.animation_fps
+            remaining = last_send_time + interval - now
+            if remaining <= 0:
+                due.append(light)
+            else:
+                wait = min(wait, remaining)
+        return due, wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due, wait = self._due(time.monotonic())
+                if not due:
+                    self._condition.wait(wait)
+                    continue
+
+            for light in due:
+                try:
+                    light.flush()
+                except Exception:
+                    log.exception("Failed to send keepalive")
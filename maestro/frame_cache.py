@@ -0,0 +1,149 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+
+from animations.animation_interface import TimeBasedAnimation
+
+
+class _Cycle:
+    def __init__(self, frames, loop_start):
+        self.frames = frames
+        self.loop_start = loop_start
+        self.size = sum(len(frame) for frame in frames)
+
+
+class FrameCache:
+    """An LRU cache of the frames rendered by periodic animations.
+
+    Animations declare that they are periodic by implementing cache_state().
+    The first time a periodic animation is run, its frames are captured until
+    its state repeats. From then on, and whenever the same animation is
+    started with the same config on a light of the same length and fps, the
+    captured frames are replayed instead of being rendered.
+
+    Frames are captured one frame period apart, and replayed by the time
+    elapsed, skipping frames when rendering falls behind.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._cycles = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def key(animation, light, config):
+        """Return the key of the frames of an animation started with a config
+        on a light. Raises a TypeError or ValueError if the config can't be
+        serialised to JSON.
+        """
+        config = json.dumps(config, sort_keys=True)
+        return (animation.name, config, light.num_leds, light.animation_fps)
+
+    def wrap(self, animation, light, config):
+        """Return an animation that replays or captures the frames of the
+        given animation, started with a config (as received). Animations that
+        aren't periodic, or whose config can't be used as a key, are returned
+        as-is.
+        """
+        if self.max_bytes == 0 or animation.cache_state() is None:
+            return animation
+        try:
+            key = self.key(animation, light, config)
+        except (TypeError, ValueError):
+            return animation
+        return CachedAnimation(self, animation, light, key)
+
+    def get(self, key):
+        with self._lock:
+            cycle = self._cycles.get(key)
+            if cycle is not None:
+                self._cycles.move_to_end(key)
+            return cycle
+
+    def put(self, key, cycle):
+        if cycle.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._cycles:
+                return
+            self._cycles[key] = cycle
+            self._size += cycle.size
+            while self._size > self.max_bytes:
+                _, evicted = self._cycles.popitem(last=False)
+                self._size -= evicted.size
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._cycles)
+
+
+class CachedAnimation(TimeBasedAnimation):
+    def __init__(self, cache, animation, light, key):
+        self.cache = cache
+        self.animation = animation
+        self.light = light
+        self._key = key
+
+        self._cycle = cache.get(self._key)
+        # Position in the cycle being replayed, in frames
+        self._position = None
+
+        # State before each captured frame, mapped to the frame's index
+        self._states = {}
+        self._frames = []
+        self._captured_size = 0
+
+    def advance(self, elapsed):
+        if self._cycle is not None:
+            if self._position is None:
+                self._position = 0
+            else:
+                self._position += elapsed * self.light.animation_fps
+            return self._replay_frame()
+
+        if self._frames is not None:
+            state = self.animation.cache_state()
+            if state in self._states:
+                # The animation is about to repeat itself
+                self._cycle = _Cycle(self._frames, self._states[state])
+                self._position = self._cycle.loop_start
+                self.cache.put(self._key, self._cycle)
+                return self._replay_frame()
+            self._states[state] = len(self._frames)
+
+        # While capturing, the animation is advanced a frame period at a time
+        # so that its states repeat
+        finished = self.animation.advance(1 / self.light.animation_fps)
+
+        if self._frames is not None:
+            if finished is True:
+                self._frames = self._states = None
+            else:
+                frame = bytes(self.light.pixels)
+                self._frames.append(frame)
+                self._captured_size += len(frame)
+                if self._captured_size > self.cache.max_bytes:
+                    # Too long to cache, give up capturing
+                    self._frames = self._states = None
+        return finished
+
+    def _replay_frame(self):
+        frames = self._cycle.frames
+        if self._position >= len(frames):
+            loop_start = self._cycle.loop_start
+            self._position = loop_start + (self._position - loop_start) % (
+                len(frames) - loop_start
+            )
+        self.light.set_pixels(frames[int(self._position)])
+        return False
+
+    def stop(self):
+        self.animation.stop()
+
+    @property
+    def name(self):
+        return self.animation.name
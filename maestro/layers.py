@@ -0,0 +1,170 @@
+"""Layers, for running several animations on one light.
+
+Each layer has its own frame buffer that its animation draws into. As the
+light is sent, its layers are blended over its frame buffer, bottom first,
+using the layer's blend mode and opacity:
+
+* over: the layer covers what is below it, except where it is black.
+* add: the layer is added to what is below it.
+* max: the brighter of the layer and what is below it, channel by channel.
+* multiply: what is below the layer is multiplied by it, so the layer tints
+  or darkens it.
+
+If NumPy is installed, layers are blended as array operations. Otherwise a
+pure Python implementation is used.
+"""
+
+import operator
+
+import realtime
+from light import Light, NullSink
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLEND_MODES = ("over", "add", "max", "multiply")
+
+_SATURATE = bytes(range(256)) + bytes([255] * 255)
+
+
+class Layer(Light):
+    """A layer of a light, drawn into by an animation like a light."""
+
+    def __init__(self, light, name, opacity=1, blend="over"):
+        if blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode '{blend}'")
+        super().__init__(
+            None,
+            None,
+            light.num_leds,
+            light.animation_fps,
+            # Layers are drawn in the light's logical order, and remapped with
+            # it once composited
+            layout=light.layout,
+            # Layers are composited by their light rather than sent
+            sock=NullSink(),
+        )
+        self.name = name
+        self.blend_mode = blend
+        self.running = None
+        self._mix_table = None
+        self.opacity = opacity
+
+    @property
+    def opacity(self):
+        return self._opacity
+
+    @opacity.setter
+    def opacity(self, value):
+        self._opacity = value
+        self._scale_table = bytes(round(i * value) for i in range(256))
+        self._mix_table = None
+
+    def update(self, force=False, batch=None):
+        return False
+
+    def changed_range(self):
+        """Return the range of LEDs (first, end) changed since the layer was
+        last composited, or None.
+        """
+        return realtime.changed_range(self._pixels, self._sent)
+
+    def composited(self):
+        """Record that the layer has been composited in its current state."""
+        if self._dirty is True:
+            self._sent[:] = self._pixels
+            self._dirty = False
+
+    def blend(self, out, start, stop):
+        """Blend the layer's pixels from byte start to stop into out, a
+        writable buffer of the same length holding what is below the layer.
+        """
+        pixels = bytes(self._pixels[start:stop])
+        if numpy is not None:
+            self._blend_numpy(out, pixels)
+        else:
+            self._blend_python(out, pixels)
+
+    def _blend_numpy(self, out, pixels):
+        below = numpy.frombuffer(out, dtype=numpy.uint8)
+        layer = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        opacity = self._opacity
+
+        if self.blend_mode == "over":
+            opaque = layer.reshape(-1, 3).any(axis=1).repeat(3)
+            if opacity == 1:
+                below[opaque] = layer[opaque]
+            else:
+                mixed = (
+                    below[opaque]
+                    + (layer[opaque].astype(numpy.float32) - below[opaque])
+                    * opacity
+                )
+                below[opaque] = numpy.rint(mixed)
+            return
+
+        if self.blend_mode == "multiply":
+            factor = 1 - opacity + layer * (opacity / 255)
+            below[:] = numpy.rint(below * factor)
+            return
+
+        scaled = numpy.frombuffer(
+            pixels.translate(self._scale_table), dtype=numpy.uint8
+        )
+        if self.blend_mode == "add":
+            below[:] = numpy.minimum(below.astype(numpy.uint16) + scaled, 255)
+        else:
+            numpy.maximum(below, scaled, out=below)
+
+    def _blend_python(self, out, pixels):
+        if self.blend_mode == "over":
+            if self._opacity == 1:
+                for idx in range(0, len(pixels), 3):
+                    if pixels[idx] or pixels[idx + 1] or pixels[idx + 2]:
+                        out[idx : idx + 3] = pixels[idx : idx + 3]
+                return
+            mix = self._mix()
+            for idx in range(0, len(pixels), 3):
+                if pixels[idx] or pixels[idx + 1] or pixels[idx + 2]:
+                    for channel in range(idx, idx + 3):
+                        out[channel] = mix[
+                            (pixels[channel] << 8) | out[channel]
+                        ]
+            return
+
+        if self.blend_mode == "multiply":
+            mix = self._mix()
+            out[:] = bytes(
+                mix[(layer << 8) | below] for layer, below in zip(pixels, out)
+            )
+            return
+
+        scaled = pixels.translate(self._scale_table)
+        if self.blend_mode == "add":
+            out[:] = bytes(
+                map(_SATURATE.__getitem__, map(operator.add, out, scaled))
+            )
+        else:
+            out[:] = bytes(map(max, out, scaled))
+
+    def _mix(self):
+        """Return a table of the blended value of every pair of layer and
+        below values, indexed by (layer << 8) | below.
+        """
+        if self._mix_table is None:
+            opacity = self._opacity
+            if self.blend_mode == "multiply":
+                self._mix_table = bytes(
+                    round(below * (1 - opacity + layer * opacity / 255))
+                    for layer in range(256)
+                    for below in range(256)
+                )
+            else:
+                self._mix_table = bytes(
+                    round(below + (layer - below) * opacity)
+                    for layer in range(256)
+                    for below in range(256)
+                )
+        return self._mix_table
@@ -0,0 +1,166 @@
+"""Mapping the LEDs animations draw to the LEDs as they are wired.
+
+Animations draw in logical order: along the strip for a linear light, or
+row by row from the top left for a matrix. A Layout maps each logical LED to
+its physical position on the wire. This covers serpentine and progressive
+matrices wired from any corner, strips mounted in reverse, strips whose
+first LED is offset along them (e.g. rings), and arbitrary maps.
+
+The mapping is compiled once into a table and applied to the whole frame as
+a single permutation as it is sent. If NumPy is installed, this is an array
+operation. Otherwise a pure Python implementation is used.
+"""
+
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LAYOUT_TYPES = ("linear", "matrix", "map")
+MATRIX_STARTS = ("top_left", "top_right", "bottom_left", "bottom_right")
+
+
+class Layout:
+    """The physical position of each logical LED of a light, drawn on as a
+    grid of width by height LEDs.
+    """
+
+    def __init__(self, table, width=None, height=1):
+        table = list(table)
+        if sorted(table) != list(range(len(table))):
+            raise ValueError(
+                f"A layout must map each of the {len(table)} LEDs to a "
+                "different LED"
+            )
+        if width is None:
+            width = len(table)
+        if width * height != len(table):
+            raise ValueError(
+                f"A {width}x{height} layout needs {width * height} LEDs, "
+                f"not {len(table)}"
+            )
+        self.table = table
+        self.width = width
+        self.height = height
+        self.is_identity = table == list(range(len(table)))
+
+        # The logical LED shown by each physical LED, as a permutation
+        # gathering the frame in wiring order
+        source = [0] * len(table)
+        for logical, physical in enumerate(table):
+            source[physical] = logical
+        if numpy is not None:
+            self._source = numpy.array(source, dtype=numpy.intp)
+        else:
+            self._gather = operator.itemgetter(
+                *(
+                    logical * 3 + channel
+                    for logical in source
+                    for channel in range(3)
+                )
+            )
+
+    @classmethod
+    def linear(cls, num_leds):
+        return cls(range(num_leds))
+
+    @classmethod
+    def matrix(
+        cls, width, height, serpentine=False, start="top_left", vertical=False
+    ):
+        """A matrix wired row by row (or column by column if vertical) from
+        the start corner. Serpentine matrices reverse direction at the end of
+        each row, progressive matrices return to the same side.
+        """
+        if start not in MATRIX_STARTS:
+            raise ValueError(f"Unknown matrix start '{start}'")
+        from_right = start.endswith("right")
+        from_bottom = start.startswith("bottom")
+
+        table = []
+        for y in range(height):
+            row = height - 1 - y if from_bottom else y
+            for x in range(width):
+                column = width - 1 - x if from_right else x
+                line, position, length = (
+                    (column, row, height) if vertical else (row, column, width)
+                )
+                if serpentine and line % 2 == 1:
+                    position = length - 1 - position
+                table.append(line * length + position)
+        return cls(table, width, height)
+
+    def reversed(self):
+        """The layout with the strip mounted the other way round."""
+        last = len(self.table) - 1
+        return Layout(
+            [last - physical for physical in self.table],
+            self.width,
+            self.height,
+        )
+
+    def rotated(self, offset):
+        """The layout moved offset LEDs along the strip, wrapping round."""
+        num_leds = len(self.table)
+        return Layout(
+            [(physical + offset) % num_leds for physical in self.table],
+            self.width,
+            self.height,
+        )
+
+    @classmethod
+    def from_config(cls, config, num_leds):
+        """Compile a validated layout config for a light with num_leds LEDs.
+        Returns None if there is no config. Raises a ValueError if the
+        layout doesn't fit the light.
+        """
+        if config is None:
+            return None
+
+        if config["type"] == "matrix":
+            width = config["width"]
+            if width is None or num_leds % width != 0:
+                raise ValueError(
+                    f"A matrix of {num_leds} LEDs needs a width that divides "
+                    "it"
+                )
+            layout = cls.matrix(
+                width,
+                num_leds // width,
+                serpentine=config["serpentine"],
+                start=config["start"],
+                vertical=config["vertical"],
+            )
+        elif config["type"] == "map":
+            if config["map"] is None or len(config["map"]) != num_leds:
+                raise ValueError(
+                    f"A map of {num_leds} LEDs must list {num_leds} LEDs"
+                )
+            width = config["width"] or num_leds
+            if num_leds % width != 0:
+                raise ValueError(
+                    f"A map of {num_leds} LEDs needs a width that divides it"
+                )
+            layout = cls(config["map"], width, num_leds // width)
+        else:
+            layout = cls.linear(num_leds)
+
+        if config["reverse"] is True:
+            layout = layout.reversed()
+        if config["offset"] % num_leds != 0:
+            layout = layout.rotated(config["offset"])
+        return layout
+
+    def apply(self, pixels, out):
+        """Write pixels, in logical order, into out in wiring order."""
+        if numpy is not None:
+            numpy.take(
+                numpy.frombuffer(pixels, dtype=numpy.uint8).reshape(-1, 3),
+                self._source,
+                axis=0,
+                out=numpy.frombuffer(out, dtype=numpy.uint8).reshape(-1, 3),
+            )
+        else:
+            out[:] = bytes(self._gather(pixels))
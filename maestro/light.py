@@ -1,106 +1,750 @@
 import math
-import socket
 import time
-from threading import Thread
+from threading import Event, Lock, Thread
+
+import palettes
+import realtime
+from engine import KeepaliveTimer
+from logger import log
+from output import OutputStage
+from scheduler import FrameGovernor, FrameScheduler, FrameStats
+from transport import Connection
+
+
+class _Running:
+    """An animation running on a light or layer, and the callback to call
+    when it finishes.
+    """
+
+    __slots__ = ("animation", "callback", "callback_data", "_last")
+
+    # The most time an animation is advanced by in one frame, so it doesn't
+    # race to catch up after rendering stalls
+    MAX_ELAPSED = 1
+
+    def __init__(self, animation, callback=None, callback_data=None):
+        self.animation = animation
+        self.callback = callback
+        self.callback_data = callback_data
+        self._last = None
+
+    def step(self, finished, now, period):
+        """Render the frame of the animation at time now. The first frame is
+        a frame period after the animation started. Returns True if it has
+        finished (or failed), in which case its callback is appended to
+        finished.
+        """
+        if self._last is None:
+            elapsed = period
+        else:
+            elapsed = min(now - self._last, self.MAX_ELAPSED)
+        self._last = now
+        try:
+            if self.animation.advance(elapsed) is not True:
+                return False
+        except Exception:
+            log.exception(f"Animation '{self.animation.name}' failed")
+            self.stop()
+            return True
+        self.stop()
+        if self.callback is not None:
+            finished.append((self.callback, self.callback_data))
+        return True
+
+    def stop(self):
+        """Tell the animation it is no longer running."""
+        try:
+            self.animation.stop()
+        except Exception:
+            log.exception(f"Failed to stop animation '{self.animation.name}'")
 
 
 class Light:
+    HEADER_SIZE = 2
+    # Resends the frames of idle lights with a timeout, shared by every light
+    keepalive_timer = KeepaliveTimer()
+
     def __init__(
         self,
         ip_address,
         port,
         num_leds,
         animation_fps=30,
+        engine=None,
+        timeout=255,
+        keepalive=1,
+        protocol="auto",
+        brightness=1,
+        gamma=1,
+        white_balance=(1, 1, 1),
+        resolve_interval=300,
+        min_fps=None,
+        layout=None,
+        sock=None,
     ):
         self.ip_address = ip_address
         self.port = port
         self.num_leds = num_leds
         self.animation_fps = animation_fps
+        # If set, the fps is lowered as far as this while rendering can't
+        # keep up with animation_fps
+        self.min_fps = min_fps
+        self.engine = engine
+        self.keepalive = keepalive
+        realtime.validate(protocol, num_leds)
+        self.protocol = protocol
+        if layout is not None and len(layout.table) != num_leds:
+            raise ValueError(
+                f"Layout is for {len(layout.table)} LEDs, not {num_leds}"
+            )
+        # How the LEDs are arranged (see layout.py). Frames are remapped to
+        # wiring order as they are sent, unless the layout is the identity.
+        self.layout = layout
+        self._remap = None
+        if layout is not None and layout.is_identity is False:
+            self._remap = layout
+
+        # The running animation and the layers over it, bottom first
+        self._animation = None
+        self._layers = []
+        # Set to stop rendering frames. Every run of the render loop gets its
+        # own event so a new run never inherits a stale cancellation.
+        self._cancel_animation = None
+        # Held while the frame buffer is being written and sent.
+        self._lock = Lock()
+        # Set by close(), after which animations can't be started and
+        # nothing is sent
+        self._closed = False
+        # Called once when the animation is next stopped or replaced
+        self._stop_hooks = []
+        self._frame_stats = FrameStats()
+        # The schedule and governor of the current run of the render loop
+        self._scheduler = None
+        self._governor = None
+        self._connection = Connection(
+            ip_address,
+            port,
+            resolve_interval,
+            sock=sock,
+            on_resolved=self._resolved,
+        )
+
+        # The frame buffer holds the complete DRGB packet (header followed by
+        # one RGB triplet per LED) so it can be sent without being rebuilt.
+        # Other protocols send slices of the pixel data after their own
+        # headers.
+        self._buffer = bytearray(self.HEADER_SIZE + (num_leds * 3))
+        self._buffer[0] = realtime.DRGB
+        self._buffer[1] = timeout
+        self._pixels = memoryview(self._buffer)[self.HEADER_SIZE :]
+        self._blank = bytes(len(self._pixels))
 
-        self._animation_thread = None
-        self._stop_animation = False
-        self._server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # The set_* methods flag the buffer as dirty. A dirty buffer is then
+        # compared with a copy of the last one sent so that unchanged frames
+        # are only resent as a keepalive.
+        self._dirty = True
+        self._sent = bytearray(len(self._pixels))
+        self._last_send_time = None
 
-        self._state = []
-        self.clear_leds()
+        # Corrections applied to the frame as it is sent. When there is
+        # something to correct, the result is written to a second buffer so
+        # the frame buffer animations work with is left untouched.
+        self._output_stage = OutputStage(brightness, gamma, white_balance)
+        self._output_buffer = bytearray(self._buffer)
+        self._output_pixels = memoryview(self._output_buffer)[
+            self.HEADER_SIZE :
+        ]
+
+        # With layers, the frame buffer and layers are composited into a
+        # third buffer. Copies of what was last composited allow only the
+        # LEDs that changed to be reblended.
+        self._composite = None
+        self._composited = None
+        self._recomposite = True
+        # With both a layout and corrections, the remapped frame is held in a
+        # fourth buffer before being corrected
+        self._remapped = None
+
+        if timeout < 255:
+            self.keepalive_timer.register(self)
+
+    @property
+    def timeout(self):
+        """The number of seconds the controller waits for a packet before
+        returning to normal operation. 255 disables the timeout.
+        """
+        return self._buffer[1]
+
+    @timeout.setter
+    def timeout(self, value):
+        self._buffer[1] = value
+        self._output_buffer[1] = value
+        self._dirty = True
+        if value < 255:
+            self.keepalive_timer.register(self)
+
+    @property
+    def brightness(self):
+        return self._output_stage.brightness
+
+    def set_brightness(self, brightness):
+        """Set the master brightness (0-1) of the light and send the current
+        frame at the new brightness.
+        """
+        with self._lock:
+            self._output_stage.brightness = brightness
+            self._dirty = True
+            self.update()
+
+    def set_corrections(self, brightness, gamma, white_balance):
+        """Set the master brightness, gamma and white balance of the light
+        and send the current frame with them.
+        """
+        with self._lock:
+            stage = self._output_stage
+            if brightness != stage.brightness:
+                stage.brightness = brightness
+            if gamma != stage.gamma:
+                stage.gamma = gamma
+            if tuple(white_balance) != stage.white_balance:
+                stage.white_balance = white_balance
+            self._dirty = True
+            self.update()
 
-    def update(self):
-        protocol = 2  # DRGB
-        timeout = 255  # Disabled
-        message = bytes(
-            [protocol, timeout] + [col for led in self._state for col in led]
+    def set_animation_fps(self, animation_fps, min_fps=None):
+        """Change the fps (and lowest fps to drop to under load). A running
+        animation switches to it from the next frame.
+        """
+        with self._lock:
+            self.animation_fps = animation_fps
+            self.min_fps = min_fps
+            scheduler = self._scheduler
+            if self._cancel_animation is None or scheduler is None:
+                return
+            self._governor = None
+            if min_fps is not None:
+                self._governor = FrameGovernor(animation_fps, min_fps)
+            scheduler.governor = self._governor
+            scheduler.fps = animation_fps
+
+    def set_connection(self, ip_address, port, resolve_interval=300):
+        """Send to a new address from the next frame, which is sent in full.
+        Counts of what has been sent carry over.
+        """
+        with self._lock:
+            old = self._connection
+            connection = Connection(
+                ip_address,
+                port,
+                resolve_interval,
+                on_resolved=self._resolved,
+            )
+            connection.packets = old.packets
+            connection.bytes = old.bytes
+            connection.errors = old.errors
+            self._connection = connection
+            old.close()
+            self.ip_address = ip_address
+            self.port = port
+            self._last_send_time = None
+
+    def close(self):
+        """Stop the animation and layers and close the light's socket. The
+        light can't be used again.
+        """
+        with self._lock:
+            self._closed = True
+        self.keepalive_timer.unregister(self)
+        self.stop_animation()
+        with self._lock:
+            self._connection.close()
+
+    def mark_dirty(self):
+        """Flag the frame buffer as changed. Only needed by code that writes
+        to the buffer without using the set_* methods.
+        """
+        self._dirty = True
+
+    def update(self, force=False, batch=None):
+        """Send the frame buffer to the light.
+
+        The send is skipped if the frame has not changed since it was last
+        sent, unless it is forced or the keepalive interval has elapsed.
+        Otherwise only the changed LEDs are sent where the protocol allows it.
+        If a transport.Batch is given, the packets are added to it to be sent
+        later instead. Returns True if the frame was sent.
+        """
+        if self._closed is True:
+            return False
+        if self._connection.ready is False:
+            # The host is being resolved in the background. The frame is
+            # sent in full once it has been.
+            self._connection.resolve()
+            return False
+        now = time.monotonic()
+        full = (
+            force is True
+            or self._last_send_time is None
+            or now - self._last_send_time >= self.keepalive
         )
-        self._server.sendto(message, (self.ip_address, self.port))
+        if full is False and self._is_dirty() is False:
+            self._frame_stats.skipped_frames += 1
+            return False
+        frame, pixels = self._output_frame()
+
+        if full is False and self._sent == pixels:
+            self._frame_stats.skipped_frames += 1
+            return False
+
+        packets = realtime.encode(
+            self.protocol,
+            frame,
+            pixels,
+            self.timeout,
+            previous=None if full else self._sent,
+        )
+        if batch is None:
+            for packet in packets:
+                self._connection.send(packet)
+        else:
+            batch.add(self._connection, packets)
+        self._sent[:] = pixels
+        self._dirty = False
+        self._last_send_time = now
+        return True
+
+    def _resolved(self):
+        # Called once the host has first been resolved, so a light left
+        # showing a frame that couldn't be sent is sent
+        self.flush(force=True)
+
+    def _is_dirty(self):
+        if self._dirty is True:
+            return True
+        for layer in self._layers:
+            if layer._dirty is True:
+                return True
+        return False
+
+    def _output_frame(self):
+        """Composite the layers and apply the output stage, clearing the
+        dirty flags. Returns the frame (header and pixels) to send and a view
+        of its pixels.
+        """
+        if self._layers:
+            source = self._composite_layers()
+        elif self._output_stage.is_identity and self._remap is None:
+            self._dirty = False
+            return self._buffer, self._pixels
+        else:
+            source = self._pixels
+        self._dirty = False
+        if self._remap is None:
+            self._output_stage.apply(source, self._output_pixels)
+        elif self._output_stage.is_identity:
+            self._remap.apply(source, self._output_pixels)
+        else:
+            if self._remapped is None:
+                self._remapped = bytearray(len(self._pixels))
+            self._remap.apply(source, self._remapped)
+            self._output_stage.apply(self._remapped, self._output_pixels)
+        return self._output_buffer, self._output_pixels
+
+    def _composite_layers(self):
+        """Blend the layers over the frame buffer, bottom first, reblending
+        only the range of LEDs that changed since the last composite. Returns
+        the composited pixels.
+        """
+        size = len(self._pixels)
+        if self._composite is None:
+            self._composite = bytearray(size)
+            self._composited = bytearray(size)
+            self._recomposite = True
+
+        if self._recomposite is True:
+            first, end = 0, self.num_leds
+        else:
+            first, end = self.num_leds, 0
+            if self._dirty is True:
+                changed = realtime.changed_range(
+                    self._pixels, self._composited
+                )
+                if changed is not None:
+                    first, end = changed
+            for layer in self._layers:
+                if layer._dirty is True:
+                    changed = layer.changed_range()
+                    if changed is not None:
+                        first = min(first, changed[0])
+                        end = max(end, changed[1])
+
+        if first < end:
+            start, stop = first * 3, end * 3
+            composite = memoryview(self._composite)[start:stop]
+            composite[:] = self._pixels[start:stop]
+            for layer in self._layers:
+                layer.blend(composite, start, stop)
+            self._composited[:] = self._pixels
+        for layer in self._layers:
+            layer.composited()
+        self._recomposite = False
+        return self._composite
+
+    def flush(self, force=False, batch=None):
+        """Send the frame buffer, as update() does, but safe to call while an
+        animation is running on the light.
+        """
+        with self._lock:
+            return self.update(force, batch)
+
+    @property
+    def pixels(self):
+        """A writable memoryview of the RGB data in the frame buffer, three
+        bytes per LED. Call mark_dirty() after writing to it.
+        """
+        return self._pixels
+
+    def set_pixels(self, data, start_led=0):
+        """Replace the RGB data of the LEDs from start_led onwards with a
+        bytes-like object of three bytes per LED.
+        """
+        start = start_led * 3
+        self._pixels[start : start + len(data)] = data
+        self._dirty = True
+
+    def get_led(self, led_idx):
+        """Return the current [r, g, b] value of an LED."""
+        start = led_idx * 3
+        return list(self._pixels[start : start + 3])
 
     def set_led(self, led_idx, rgb, brightness=1):
-        self._state[led_idx] = self._col_at_bri(rgb, brightness)
+        start = led_idx * 3
+        self._pixels[start : start + 3] = bytes(
+            self._col_at_bri(rgb, brightness)
+        )
+        self._dirty = True
 
     def set_leds(self, rgb, brightness=1):
-        self._state = [
-            self._col_at_bri(rgb, brightness) for led in range(self.num_leds)
-        ]
+        self._pixels[:] = bytes(self._col_at_bri(rgb, brightness)) * (
+            self.num_leds
+        )
+        self._dirty = True
 
     def on(self):
         self.stop_animation()
-        self.set_leds([255, 255, 255])
-        self.update()
+        with self._lock:
+            self.set_leds([255, 255, 255])
+            self.update(force=True)
 
     def clear_leds(self):
-        self.set_leds([0, 0, 0])
+        self._pixels[:] = self._blank
+        self._dirty = True
 
     def off(self):
         self.stop_animation()
-        self.clear_leds()
-        self.update()
+        with self._lock:
+            self.clear_leds()
+            self.update(force=True)
 
     @classmethod
     def _linspace(cls, start, stop, count):
-        step = (stop - start) / float(count)
+        """Return count values from start to stop inclusive."""
+        if count == 1:
+            return [start]
+        step = (stop - start) / (count - 1)
         return [round(start + i * step) for i in range(count)]
 
     def set_gradient(self, start_rgb, end_rgb):
-        lin_r = self._linspace(start_rgb[0], end_rgb[0], self.num_leds)
-        lin_g = self._linspace(start_rgb[1], end_rgb[1], self.num_leds)
-        lin_b = self._linspace(start_rgb[2], end_rgb[2], self.num_leds)
-        self._state = [
-            [lin_r[i], lin_g[i], lin_b[i]] for i in range(self.num_leds)
-        ]
+        """Fade the LEDs from start_rgb on the first to end_rgb on the last.
+        For gradients of more than two colours, see fill_palette().
+        """
+        for col_idx in range(3):
+            self._buffer[self.HEADER_SIZE + col_idx :: 3] = bytes(
+                self._linspace(
+                    start_rgb[col_idx], end_rgb[col_idx], self.num_leds
+                )
+            )
+        self._dirty = True
 
     def set_percentage(self, percentage, on_rgb, off_rgb=[0, 0, 0]):
         num_on_leds = math.ceil((self.num_leds / 100) * percentage)
-        num_off_leds = self.num_leds - num_on_leds
-        self._state = [on_rgb for led in range(num_on_leds)] + [
-            off_rgb for led in range(num_off_leds)
-        ]
+        split = num_on_leds * 3
+        self._pixels[:split] = bytes(on_rgb) * num_on_leds
+        self._pixels[split:] = bytes(off_rgb) * (self.num_leds - num_on_leds)
+        self._dirty = True
+
+    def fill_palette(
+        self, palette, offset=0, start_led=0, end_led=None, repeat=1
+    ):
+        """Spread a palette (see palettes.py) across the LEDs from start_led
+        up to end_led, repeat times, starting offset colours into it. Moving
+        the offset from frame to frame scrolls the palette along the LEDs.
+        """
+        if end_led is None:
+            end_led = self.num_leds
+        if end_led <= start_led:
+            return
+        indices = palettes.spread(end_led - start_led, repeat)
+        start = self.HEADER_SIZE + start_led * 3
+        stop = self.HEADER_SIZE + end_led * 3
+        for col_idx, table in enumerate(palette.rotated_channels(offset)):
+            self._buffer[start + col_idx : stop : 3] = indices.translate(table)
+        self._dirty = True
+
+    def set_palette_indices(self, indices, palette, start_led=0):
+        """Set the LEDs from start_led onwards to the palette colours at a
+        bytes-like object of indices (0-255), one per LED.
+        """
+        indices = bytes(indices)
+        start = self.HEADER_SIZE + start_led * 3
+        stop = start + len(indices) * 3
+        for col_idx, table in enumerate(palette.channels):
+            self._buffer[start + col_idx : stop : 3] = indices.translate(table)
+        self._dirty = True
+
+    @property
+    def width(self):
+        """The number of LEDs in each row. Lights without a layout (or with
+        a linear one) are a single row.
+        """
+        return self.num_leds if self.layout is None else self.layout.width
+
+    @property
+    def height(self):
+        """The number of rows of LEDs."""
+        return 1 if self.layout is None else self.layout.height
+
+    def xy_index(self, x, y):
+        """Return the index of the LED at column x of row y, counting from
+        the top left.
+        """
+        return y * self.width + x
+
+    def get_xy(self, x, y):
+        """Return the current [r, g, b] value of the LED at (x, y)."""
+        return self.get_led(self.xy_index(x, y))
+
+    def set_xy(self, x, y, rgb, brightness=1):
+        self.set_led(self.xy_index(x, y), rgb, brightness)
+
+    def fill_row(self, y, rgb, brightness=1):
+        width = self.width
+        start = y * width * 3
+        self._pixels[start : start + width * 3] = (
+            bytes(self._col_at_bri(rgb, brightness)) * width
+        )
+        self._dirty = True
+
+    def fill_column(self, x, rgb, brightness=1):
+        rgb = self._col_at_bri(rgb, brightness)
+        for col_idx in range(3):
+            self._buffer[
+                self.HEADER_SIZE + x * 3 + col_idx :: self.width * 3
+            ] = (bytes([rgb[col_idx]]) * self.height)
+        self._dirty = True
+
+    @property
+    def _state(self):
+        """A list of [r, g, b] values, one per LED.
+
+        Deprecated: Kept for compatibility with animations written before the
+        frame buffer was introduced. Use get_led() instead.
+        """
+        return [self.get_led(led_idx) for led_idx in range(self.num_leds)]
 
     def start_animation(self, animation, callback=None, callback_data=None):
-        self.stop_animation()
-        self._animation_thread = Thread(
-            target=self._start_animation,
-            args=(animation, callback, callback_data),
+        """Start an animation, replacing any animation already running (but
+        not the layers over it). The new animation takes over from the next
+        frame. The callback is called with the callback data when the
+        animation finishes.
+        """
+        with self._lock:
+            if self._closed is True:
+                # e.g. the light was replaced by a config reload
+                log.warning("Not starting animation on a closed light")
+                animation.stop()
+                return
+            replaced = self._animation is not None
+            if replaced:
+                self._animation.stop()
+            self._animation = _Running(animation, callback, callback_data)
+            self._start_rendering()
+        if replaced:
+            self._run_stop_hooks()
+
+    def add_layer(self, layer, animation, callback=None, callback_data=None):
+        """Run an animation on a layer, over the light's animation and any
+        existing layers. A layer with the same name is replaced, keeping its
+        place. The layer is removed when the animation finishes, after which
+        the callback is called with the callback data.
+        """
+        layer.running = _Running(animation, callback, callback_data)
+        with self._lock:
+            if self._closed is True:
+                log.warning("Not adding layer to a closed light")
+                layer.running.stop()
+                return
+            for idx, existing in enumerate(self._layers):
+                if existing.name == layer.name:
+                    existing.running.stop()
+                    self._layers[idx] = layer
+                    break
+            else:
+                self._layers.append(layer)
+            self._recomposite = True
+            self._start_rendering()
+
+    def remove_layer(self, name):
+        """Remove a layer. Returns False if there is no layer with the name."""
+        with self._lock:
+            layers = []
+            for layer in self._layers:
+                if layer.name == name:
+                    layer.running.stop()
+                else:
+                    layers.append(layer)
+            if len(layers) == len(self._layers):
+                return False
+            self._layers = layers
+            self._recomposite = True
+            self._dirty = True
+        return True
+
+    @property
+    def animating(self):
+        """Whether frames are being rendered, i.e. an animation or layer is
+        running.
+        """
+        return self._cancel_animation is not None
+
+    @property
+    def layers(self):
+        """The names of the layers, bottom first."""
+        return [layer.name for layer in self._layers]
+
+    def _start_rendering(self):
+        """Start the render loop, unless it is already running. Must be
+        called with the lock held.
+        """
+        if self._cancel_animation is not None:
+            return
+        cancelled = Event()
+        self._cancel_animation = cancelled
+        self._governor = None
+        if self.min_fps is not None:
+            self._governor = FrameGovernor(self.animation_fps, self.min_fps)
+        scheduler = FrameScheduler(
+            self.animation_fps, self._frame_stats, self._governor
         )
-        self._animation_thread.start()
+        self._scheduler = scheduler
 
-    def _start_animation(self, animation, callback=None, callback_data=None):
-        frame_duration = 1 / self.animation_fps
-        while self._stop_animation is False:
-            finished = animation.set_next_frame()
-            self.update()
-            if finished is True:
+        if self.engine is not None:
+            self.engine.register(self, scheduler, cancelled)
+        else:
+            Thread(
+                target=self._render_loop, args=(scheduler, cancelled)
+            ).start()
+
+    def _render_loop(self, scheduler, cancelled):
+        scheduler.reset()
+        while True:
+            started = scheduler.begin_frame()
+            done = self._render_frame(cancelled)
+            wait = scheduler.end_frame(started)
+            # Waiting on the event (rather than sleeping) means a stop wakes
+            # the loop immediately.
+            if done or cancelled.wait(wait):
                 break
-            else:
-                time.sleep(frame_duration)
-        if self._stop_animation is False and callback is not None:
-            callback(callback_data)
-        self._stop_animation = False
+
+    def _render_frame(self, cancelled, batch=None):
+        """Render the next frame of the animation and layers, then send it
+        (or add it to a batch). Returns True once there is nothing left to
+        render. Nothing is rendered once the render loop has been cancelled.
+        """
+        finished = []
+        with self._lock:
+            if cancelled.is_set():
+                return False
+            try:
+                self._step_animations(finished, time.monotonic())
+                self.update(batch=batch)
+            except Exception:
+                log.exception("Failed to render frame")
+                self._stop_animations()
+            done = self._animation is None and not self._layers
+            if done and self._cancel_animation is cancelled:
+                self._cancel_animation = None
+
+        for callback, callback_data in finished:
+            try:
+                callback(callback_data)
+            except Exception:
+                log.exception("Finished callback failed")
+        return done
+
+    def _step_animations(self, finished, now):
+        period = 1 / self.animation_fps
+        if self._animation is not None and self._animation.step(
+            finished, now, period
+        ):
+            self._animation = None
+        if self._layers:
+            layers = [
+                layer
+                for layer in self._layers
+                if not layer.running.step(finished, now, period)
+            ]
+            if len(layers) != len(self._layers):
+                self._layers = layers
+                self._recomposite = True
+                self._dirty = True
 
     def stop_animation(self):
-        if self._animation_thread is not None:
-            self._stop_animation = True
-            while self._animation_thread.is_alive():
-                pass
-            self._stop_animation = False
-            self._animation_thread = None
+        """Stop the animation and remove every layer. Any frame already being
+        rendered completes, but no further frames are.
+        """
+        cancelled = self._cancel_animation
+        if cancelled is not None:
+            cancelled.set()
+        if self.engine is not None:
+            self.engine.unregister(self)
+        with self._lock:
+            if self._layers:
+                self._dirty = True
+            self._stop_animations()
+            if self._cancel_animation is cancelled:
+                self._cancel_animation = None
+        self._run_stop_hooks()
+
+    def add_stop_hook(self, hook):
+        """Call hook, with no arguments, when the animation and layers are
+        next stopped (including by close()) or the animation is replaced.
+        Hooks are only called once.
+        """
+        with self._lock:
+            self._stop_hooks.append(hook)
+
+    def remove_stop_hook(self, hook):
+        with self._lock:
+            if hook in self._stop_hooks:
+                self._stop_hooks.remove(hook)
+
+    def _run_stop_hooks(self):
+        with self._lock:
+            hooks, self._stop_hooks = self._stop_hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                log.exception("Stop hook failed")
+
+    def _stop_animations(self):
+        if self._animation is not None:
+            self._animation.stop()
+            self._animation = None
+        for layer in self._layers:
+            layer.running.stop()
+        self._layers = []
 
     @classmethod
     def _col_at_bri(cls, rgb, brightness):
@@ -110,6 +754,52 @@ class Light:
             round(rgb[2] * brightness),
         ]
 
+    @property
+    def frame_stats(self):
+        """Frame timing statistics (achieved fps, render time, jitter and
+        dropped frames) for animations run on this light.
+        """
+        return self._frame_stats.as_dict()
+
+    def stats(self):
+        """Runtime statistics for the light: the frame statistics, what has
+        been sent and what is running.
+        """
+        stats = self._frame_stats.as_dict()
+        connection = self._connection
+        running = self._animation
+        governor = self._governor
+        stats.update(
+            target_fps=(
+                self.animation_fps if governor is None else governor.fps
+            ),
+            bytes_sent=connection.bytes,
+            packets_sent=connection.packets,
+            send_errors=connection.errors,
+            animation=None if running is None else running.animation.name,
+            layers=len(self._layers),
+        )
+        return stats
+
     @property
     def max_index(self):
         return self.num_leds - 1
+
+
+class NullSink:
+    """Stands in for a UDP socket, counting what would have been sent."""
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        size = sum(len(buffer) for buffer in buffers)
+        self.packets += 1
+        self.bytes += size
+        return size
+
+    def sendto(self, data, address):
+        self.packets += 1
+        self.bytes += len(data)
+        return len(data)
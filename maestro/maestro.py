@@ -1,11 +1,38 @@
+import copy
+import functools
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
 from json import JSONDecodeError
 
 import paho.mqtt.client as mqtt
 import yaml
 import animations
+import metrics
+import palettes
+import realtime
+from commands import CommandQueue, Route
+from config_watcher import ConfigWatcher
+from engine import Flusher, RenderEngine
+from frame_cache import FrameCache
+from layers import BLEND_MODES, Layer
+from layout import LAYOUT_TYPES, MATRIX_STARTS, Layout
 from light import Light
 from logger import log
-from marshmallow import Schema, ValidationError, fields, validate
+from palettes import PaletteSchema
+from profiler import FrameProfiler
+from marshmallow import (
+    Schema,
+    ValidationError,
+    fields,
+    validate,
+    validates_schema,
+)
+from virtual_light import Segment, VirtualLight
+from workers import WorkerPool
 
 
 class ConfigSchemaMQTT(Schema):
@@ -17,6 +44,40 @@ class ConfigSchemaMQTT(Schema):
     client_id = fields.String(missing="maestro")
 
 
+class ConfigSchemaMetrics(Schema):
+    """Schema for the metrics section of the YAML config file."""
+
+    host = fields.String(missing="127.0.0.1")
+    port = fields.Int(validate=validate.Range(min=0, max=65535), missing=9300)
+    stats_interval = fields.Float(validate=validate.Range(min=0), missing=10)
+
+
+class ConfigSchemaLayout(Schema):
+    """Schema for the layout of a light in the YAML config file."""
+
+    type = fields.String(
+        validate=validate.OneOf(LAYOUT_TYPES), missing="linear"
+    )
+    # Matrices and maps
+    width = fields.Int(validate=validate.Range(min=1), missing=None)
+    serpentine = fields.Boolean(missing=False)
+    start = fields.String(
+        validate=validate.OneOf(MATRIX_STARTS), missing="top_left"
+    )
+    vertical = fields.Boolean(missing=False)
+    # The physical position of each LED, for maps
+    map = fields.List(fields.Int(validate=validate.Range(min=0)), missing=None)
+    reverse = fields.Boolean(missing=False)
+    offset = fields.Int(validate=validate.Range(min=0), missing=0)
+
+
+def _validate_layout(config, num_leds):
+    try:
+        Layout.from_config(config["layout"], num_leds)
+    except ValueError as e:
+        raise ValidationError(str(e), "layout")
+
+
 class ConfigSchemaLight(Schema):
     """Schema for the light section of the YAML config file."""
 
@@ -24,17 +85,147 @@ class ConfigSchemaLight(Schema):
     port = fields.Int(validate=validate.Range(min=0, max=65535), missing=21324)
     num_leds = fields.Int(validate=validate.Range(min=1), required=True)
     animation_fps = fields.Int(missing=30)
+    # Lowest fps to drop to under load. Defaults to never adapting the fps.
+    min_fps = fields.Int(validate=validate.Range(min=1), missing=None)
+    timeout = fields.Int(validate=validate.Range(min=1, max=255), missing=255)
+    keepalive = fields.Float(validate=validate.Range(min=0), missing=1)
+    resolve_interval = fields.Float(
+        validate=validate.Range(min=0), missing=300
+    )
+    protocol = fields.String(
+        validate=validate.OneOf(realtime.PROTOCOLS.keys()), missing="auto"
+    )
+    brightness = fields.Float(validate=validate.Range(min=0, max=1), missing=1)
+    gamma = fields.Float(validate=validate.Range(min=0.1, max=5), missing=1)
+    white_balance = fields.List(
+        fields.Float(validate=validate.Range(min=0, max=1)),
+        validate=validate.Length(equal=3),
+        missing=[1, 1, 1],
+    )
+    layout = fields.Nested(ConfigSchemaLayout, missing=None)
+
+    @validates_schema
+    def validate_protocol(self, data, **kwargs):
+        """Check the protocol and layout can be used for a light of this
+        length.
+        """
+        try:
+            realtime.validate(data["protocol"], data["num_leds"])
+        except ValueError as e:
+            raise ValidationError(str(e), "protocol")
+        _validate_layout(data, data["num_leds"])
+
+
+class ConfigSchemaSegment(Schema):
+    """Schema for a segment of a virtual light in the YAML config file."""
+
+    light = fields.String(required=True)
+    start = fields.Int(validate=validate.Range(min=0), missing=0)
+    # Defaults to the rest of the light
+    length = fields.Int(validate=validate.Range(min=1), missing=None)
+
+
+class ConfigSchemaVirtualLight(Schema):
+    """Schema for the virtual light section of the YAML config file."""
+
+    segments = fields.List(
+        fields.Nested(ConfigSchemaSegment),
+        validate=validate.Length(min=1),
+        required=True,
+    )
+    animation_fps = fields.Int(missing=30)
+    min_fps = fields.Int(validate=validate.Range(min=1), missing=None)
+    brightness = fields.Float(validate=validate.Range(min=0, max=1), missing=1)
+    gamma = fields.Float(validate=validate.Range(min=0.1, max=5), missing=1)
+    white_balance = fields.List(
+        fields.Float(validate=validate.Range(min=0, max=1)),
+        validate=validate.Length(equal=3),
+        missing=[1, 1, 1],
+    )
+    layout = fields.Nested(ConfigSchemaLayout, missing=None)
+
+
+class ConfigSchemaRenderProcesses(Schema):
+    """Schema for the render processes section of the YAML config file."""
+
+    processes = fields.Int(
+        validate=validate.Range(min=1), missing=lambda: os.cpu_count() or 1
+    )
+    # Run only the animations marked as CPU heavy in the processes, or all
+    animations = fields.String(
+        validate=validate.OneOf(["heavy", "all"]), missing="heavy"
+    )
 
 
 class ConfigSchema(Schema):
     """Main schema for the YAML config file."""
 
     mqtt = fields.Nested(ConfigSchemaMQTT)
+    metrics = fields.Nested(ConfigSchemaMetrics, missing=None)
+    render_processes = fields.Nested(ConfigSchemaRenderProcesses, missing=None)
+    render_engine = fields.String(
+        validate=validate.OneOf(["thread", "shared"]), missing="thread"
+    )
+    frame_cache_size = fields.Float(validate=validate.Range(min=0), missing=32)
+    plugin_dir = fields.String(missing=None)
+    profile_dir = fields.String(missing=None)
+    # Seconds between checks of the config file for changes. 0 disables.
+    config_watch_interval = fields.Float(
+        validate=validate.Range(min=0), missing=0
+    )
+    command_workers = fields.Int(validate=validate.Range(min=1), missing=1)
+    palettes = fields.Dict(
+        keys=fields.String(),
+        values=fields.Nested(PaletteSchema),
+        missing={},
+    )
     lights = fields.Dict(
         keys=fields.String(),
         values=fields.Nested(ConfigSchemaLight),
         validate=validate.Length(min=1),
     )
+    virtual_lights = fields.Dict(
+        keys=fields.String(),
+        values=fields.Nested(ConfigSchemaVirtualLight),
+        missing={},
+    )
+
+    @validates_schema
+    def validate_segments(self, data, **kwargs):
+        """Check every segment of a virtual light is within a light, and fill
+        in the lengths of segments that run to the end of their light.
+        """
+        lights = data.get("lights", {})
+        for name, virtual_light in data.get("virtual_lights", {}).items():
+            if name in lights:
+                raise ValidationError(
+                    f"Virtual light '{name}' has the same name as a light",
+                    "virtual_lights",
+                )
+            for segment in virtual_light["segments"]:
+                if segment["light"] not in lights:
+                    raise ValidationError(
+                        f"Virtual light '{name}' uses unknown light "
+                        f"'{segment['light']}'",
+                        "virtual_lights",
+                    )
+                num_leds = lights[segment["light"]]["num_leds"]
+                if segment["length"] is None:
+                    segment["length"] = num_leds - segment["start"]
+                if segment["length"] < 1 or (
+                    segment["start"] + segment["length"] > num_leds
+                ):
+                    raise ValidationError(
+                        f"Virtual light '{name}' has a segment outside of "
+                        f"light '{segment['light']}' ({num_leds} LEDs)",
+                        "virtual_lights",
+                    )
+            _validate_layout(
+                virtual_light,
+                sum(
+                    segment["length"] for segment in virtual_light["segments"]
+                ),
+            )
 
 
 class AnimationStartSchema(Schema):
@@ -44,82 +235,444 @@ class AnimationStartSchema(Schema):
     config = fields.Dict(missing={})
 
 
+class LayerAddSchema(AnimationStartSchema):
+    """Schema for the JSON MQTT payload to add a layer."""
+
+    layer = fields.Str(required=True)
+    opacity = fields.Float(validate=validate.Range(min=0, max=1), missing=1)
+    blend = fields.Str(validate=validate.OneOf(BLEND_MODES), missing="over")
+
+
+class ProfileSchema(Schema):
+    """Schema for the JSON MQTT payload to profile a light."""
+
+    frames = fields.Int(validate=validate.Range(min=1), missing=100)
+    top = fields.Int(validate=validate.Range(min=1), missing=20)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_start_payload(payload):
+    return Maestro.animation_start_schema.loads(payload)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_layer_payload(payload):
+    return Maestro.layer_add_schema.loads(payload)
+
+
 class Maestro:
     ON_INSTRUCTION = "on"
     OFF_INSTRUCTION = "off"
+    BRIGHTNESS_INSTRUCTION = "brightness"
     ANIMATION_INSTRUCTION = "animation"
     ANIMATION_START = "start"
     ANIMATION_STOP = "stop"
+    LAYER_ADD = "layer/add"
+    LAYER_REMOVE = "layer/remove"
+    PROFILE_INSTRUCTION = "profile"
+    STATE_SLOT = "state"
+    BRIGHTNESS_SLOT = "brightness"
+    PROFILE_SLOT = "profile"
+    RELOAD_INSTRUCTION = "reload"
+    CONFIG_PATH = "config.yaml"
+    # Settings that only take effect on restart
+    RESTART_SETTINGS = (
+        "mqtt",
+        "metrics",
+        "render_engine",
+        "render_processes",
+        "plugin_dir",
+        "command_workers",
+        "config_watch_interval",
+    )
     animation_start_schema = AnimationStartSchema()
+    layer_add_schema = LayerAddSchema()
+    profile_schema = ProfileSchema()
 
     def __init__(self):
         # Load Config
         self.config = self.load_config()
 
+        # Discover Animation Plugins
+        animations.discover_plugins(self.config["plugin_dir"])
+
+        # Register Palettes
+        palettes.configure(self.config["palettes"])
+
+        # Initialise Render Engine
+        self.engine = None
+        if self.config["render_engine"] == "shared":
+            self.engine = RenderEngine()
+            log.info("Rendering all lights from a shared render loop")
+
+        # Initialise Frame Cache
+        self.frame_cache = FrameCache(
+            int(self.config["frame_cache_size"] * 1024 * 1024)
+        )
+
+        # Initialise Render Processes
+        self.render_pool = None
+        render_processes = self.config["render_processes"]
+        if render_processes is not None:
+            self.render_pool = WorkerPool(
+                render_processes["processes"],
+                self.config["plugin_dir"],
+                self.config["palettes"],
+                heavy_only=render_processes["animations"] == "heavy",
+            )
+
         # Initialise Lights
         self.lights = {}
         for name, config in self.config["lights"].items():
-            host = config["host"]
-            port = config["port"]
-            num_leds = config["num_leds"]
-            animation_fps = config["animation_fps"]
-
-            self.lights[name] = Light(host, port, num_leds, animation_fps)
+            self.lights[name] = self.create_light(name, config)
 
-            log.info(
-                f"Initialised light '{name}' ({num_leds} LEDs at {host}:{port})"  # noqa
+        # Initialise Virtual Lights
+        self.flusher = Flusher()
+        for name, config in self.config["virtual_lights"].items():
+            self.lights[name] = self.create_virtual_light(
+                name, config, self.lights
             )
 
+        # Build Topic Routes
+        self.reload_topic = "/".join(
+            [self.config["mqtt"]["base_topic"], self.RELOAD_INSTRUCTION]
+        )
+        self.routes = {}
+        for name in self.lights.keys():
+            self.routes.update(self.get_routes_for_light(name))
+
+        # Initialise Command Queue
+        self.command_queue = CommandQueue(
+            self.handle_command, self.config["command_workers"]
+        )
+
         # Create MQTT Client
         self.mqtt_client = mqtt.Client(self.config["mqtt"]["client_id"])
         self.mqtt_client.on_connect = self.mqtt_on_connect
         self.mqtt_client.on_message = self.mqtt_on_message
 
+        # Initialise Metrics
+        self.metrics_server = None
+        self.stats_publisher = None
+        metrics_config = self.config["metrics"]
+        if metrics_config is not None:
+            self.metrics_server = metrics.MetricsServer(
+                metrics_config["host"],
+                metrics_config["port"],
+                self.collect_metrics,
+            )
+            if metrics_config["stats_interval"] > 0:
+                self.stats_publisher = metrics.StatsPublisher(
+                    metrics_config["stats_interval"],
+                    self.collect_metrics,
+                    self.publish_stats,
+                )
+
+        # Initialise Config Reloading
+        self._reload_lock = threading.Lock()
+        self.config_watcher = None
+        if self.config["config_watch_interval"] > 0:
+            self.config_watcher = ConfigWatcher(
+                self.CONFIG_PATH,
+                self.config["config_watch_interval"],
+                self.reload_config,
+            )
+
+    def create_light(self, name, config):
+        """Create a light from its validated config."""
+        light = Light(
+            config["host"],
+            config["port"],
+            config["num_leds"],
+            config["animation_fps"],
+            engine=self.engine,
+            timeout=config["timeout"],
+            keepalive=config["keepalive"],
+            resolve_interval=config["resolve_interval"],
+            min_fps=config["min_fps"],
+            protocol=config["protocol"],
+            brightness=config["brightness"],
+            gamma=config["gamma"],
+            white_balance=config["white_balance"],
+            layout=Layout.from_config(config["layout"], config["num_leds"]),
+        )
+        log.info(
+            f"Initialised light '{name}' ({light.num_leds} LEDs at "
+            f"{light.ip_address}:{light.port})"
+        )
+        return light
+
+    def create_virtual_light(self, name, config, lights):
+        """Create a virtual light from its validated config, with segments
+        of the given lights.
+        """
+        segments = [
+            Segment(
+                lights[segment["light"]],
+                segment["start"],
+                segment["length"],
+            )
+            for segment in config["segments"]
+        ]
+        light = VirtualLight(
+            segments,
+            self.flusher,
+            config["animation_fps"],
+            engine=self.engine,
+            brightness=config["brightness"],
+            gamma=config["gamma"],
+            white_balance=config["white_balance"],
+            min_fps=config["min_fps"],
+            layout=Layout.from_config(
+                config["layout"],
+                sum(segment.length for segment in segments),
+            ),
+        )
+        log.info(
+            f"Initialised virtual light '{name}' ({light.num_leds} LEDs "
+            f"across {len(segments)} segments)"
+        )
+        return light
+
     def load_config(self):
         """Load and validate YAML config file."""
-        with open("config.yaml", "r") as f:
+        with open(self.CONFIG_PATH, "r") as f:
             config = yaml.safe_load(f)
         schema = ConfigSchema()
         return schema.load(config)
 
+    def reload_config(self):
+        """Load the config file again and apply what has changed.
+
+        Only lights (and virtual lights) that were added, removed or changed
+        are touched, so animations on the others carry on uninterrupted.
+        Most settings are changed in place. A light is only replaced if its
+        number of LEDs or layout changed, and a virtual light if its segments
+        or layout did or a light it uses was replaced. Returns False,
+        changing nothing, if the new config is invalid.
+        """
+        with self._reload_lock:
+            try:
+                config = self.load_config()
+            except ValidationError as e:
+                log.error(f"Invalid config, not reloaded: {e.messages}")
+                return False
+            except (OSError, yaml.YAMLError) as e:
+                log.error(f"Failed to read config, not reloaded: {e}")
+                return False
+
+            for key in self.RESTART_SETTINGS:
+                if config[key] != self.config[key]:
+                    log.warning(f"Changes to '{key}' take effect on restart")
+                    config[key] = self.config[key]
+            if config == self.config:
+                log.info("Config unchanged")
+                return True
+
+            previous_config = self.config
+            previous_lights = self.lights
+            if config["palettes"] != previous_config["palettes"]:
+                palettes.configure(config["palettes"])
+                if self.render_pool is not None:
+                    self.render_pool.set_palettes(config["palettes"])
+            lights = {}
+            replaced = set()
+
+            for name, light_config in config["lights"].items():
+                previous = previous_config["lights"].get(name)
+                if (
+                    previous is not None
+                    and previous["num_leds"] == light_config["num_leds"]
+                    and previous["layout"] == light_config["layout"]
+                ):
+                    lights[name] = previous_lights[name]
+                    self.update_light(
+                        name, lights[name], previous, light_config
+                    )
+                    continue
+                if previous is not None:
+                    replaced.add(name)
+                lights[name] = self.create_light(name, light_config)
+
+            for name, light_config in config["virtual_lights"].items():
+                previous = previous_config["virtual_lights"].get(name)
+                segments = light_config["segments"]
+                if (
+                    previous is not None
+                    and previous["segments"] == segments
+                    and previous["layout"] == light_config["layout"]
+                    and not any(
+                        segment["light"] in replaced for segment in segments
+                    )
+                ):
+                    lights[name] = previous_lights[name]
+                    self.update_light(
+                        name, lights[name], previous, light_config
+                    )
+                    continue
+                lights[name] = self.create_virtual_light(
+                    name, light_config, lights
+                )
+
+            self.config = config
+            self.lights = lights
+            self.frame_cache.max_bytes = int(
+                config["frame_cache_size"] * 1024 * 1024
+            )
+            self.update_routes()
+
+            kept = {id(light) for light in lights.values()}
+            for name, light in previous_lights.items():
+                if id(light) not in kept:
+                    light.close()
+                    if name not in lights:
+                        log.info(f"Removed light '{name}'")
+            log.info("Reloaded config")
+            return True
+
+    def update_light(self, name, light, previous, config):
+        """Apply the changes between two validated configs of a light or
+        virtual light to it in place.
+        """
+        changed = [key for key in config if config[key] != previous[key]]
+        if not changed:
+            return
+        if {"host", "port", "resolve_interval"}.intersection(changed):
+            light.set_connection(
+                config["host"], config["port"], config["resolve_interval"]
+            )
+        if "timeout" in changed:
+            light.timeout = config["timeout"]
+        if "keepalive" in changed:
+            light.keepalive = config["keepalive"]
+        if "protocol" in changed:
+            light.protocol = config["protocol"]
+        if {"animation_fps", "min_fps"}.intersection(changed):
+            light.set_animation_fps(config["animation_fps"], config["min_fps"])
+        if {"brightness", "gamma", "white_balance"}.intersection(changed):
+            light.set_corrections(
+                config["brightness"], config["gamma"], config["white_balance"]
+            )
+        log.info(f"Updated {', '.join(changed)} of '{name}'")
+
+    def update_routes(self):
+        """Route the topics of every light, subscribing to the topics of
+        lights that were added and unsubscribing from those of lights that
+        were removed.
+        """
+        routes = {}
+        for name in self.lights.keys():
+            routes.update(self.get_routes_for_light(name))
+        added = sorted(routes.keys() - self.routes.keys())
+        removed = sorted(self.routes.keys() - routes.keys())
+        self.routes = routes
+        # If not connected, every topic is subscribed to on connecting
+        if added:
+            self.mqtt_client.subscribe([(topic, 0) for topic in added])
+        if removed:
+            self.mqtt_client.unsubscribe(removed)
+
     def run(self):
         """Connect to the MQTT server and loop forever."""
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(
+                signal.SIGHUP,
+                lambda signum, frame: threading.Thread(
+                    target=self.reload_config
+                ).start(),
+            )
+        if self.config_watcher is not None:
+            self.config_watcher.start()
+        if self.render_pool is not None:
+            self.render_pool.start()
+            log.info(f"Started {len(self.render_pool)} render processes")
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+            log.info(f"Serving metrics on port {self.metrics_server.port}")
+        if self.stats_publisher is not None:
+            self.stats_publisher.start()
         self.mqtt_client.connect(
             self.config["mqtt"]["host"], self.config["mqtt"]["port"]
         )
-        self.mqtt_client.loop_forever()
+        try:
+            self.mqtt_client.loop_forever()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop the animations on every light and the render processes."""
+        for light in self.lights.values():
+            light.stop_animation()
+        if self.render_pool is not None:
+            self.render_pool.stop()
+
+    def collect_metrics(self):
+        """Return the stats of every light, see metrics.collect()."""
+        return metrics.collect(self.lights, self.command_queue)
+
+    def publish_stats(self, light_name, payload):
+        """Publish the stats of a light as a JSON payload."""
+        self.mqtt_client.publish(
+            "/".join([self.config["mqtt"]["base_topic"], light_name, "stats"]),
+            payload=payload,
+        )
 
-    def get_topics_for_light(self, light_name):
-        """Return a list of topics to subscribe to for a particular light
-        name.
+    def get_routes_for_light(self, light_name):
+        """Return a dict mapping each topic to subscribe to for a particular
+        light name to the route for messages received on it.
         """
         base_topic_for_light = "/".join(
             [self.config["mqtt"]["base_topic"], light_name]
         )
+        animation_start = "/".join(
+            [self.ANIMATION_INSTRUCTION, self.ANIMATION_START]
+        )
+        animation_stop = "/".join(
+            [self.ANIMATION_INSTRUCTION, self.ANIMATION_STOP]
+        )
+        layer_add = "/".join([self.ANIMATION_INSTRUCTION, self.LAYER_ADD])
+        layer_remove = "/".join(
+            [self.ANIMATION_INSTRUCTION, self.LAYER_REMOVE]
+        )
 
-        topics = [
-            "/".join([base_topic_for_light, self.ON_INSTRUCTION]),
-            "/".join([base_topic_for_light, self.OFF_INSTRUCTION]),
-        ]
+        handlers = {
+            self.ON_INSTRUCTION: (self.handle_on, self.STATE_SLOT),
+            self.OFF_INSTRUCTION: (self.handle_off, self.STATE_SLOT),
+            self.BRIGHTNESS_INSTRUCTION: (
+                self.handle_brightness,
+                self.BRIGHTNESS_SLOT,
+            ),
+            animation_start: (self.handle_animation_start, self.STATE_SLOT),
+            animation_stop: (self.handle_animation_stop, self.STATE_SLOT),
+            # Layer commands are for different layers, so never supersede
+            # each other
+            layer_add: (self.handle_layer_add, None),
+            layer_remove: (self.handle_layer_remove, None),
+            self.PROFILE_INSTRUCTION: (
+                self.handle_profile,
+                self.PROFILE_SLOT,
+            ),
+        }
 
-        for sub_instruction in [self.ANIMATION_START, self.ANIMATION_STOP]:
-            topics.append(
-                "/".join(
-                    [
-                        base_topic_for_light,
-                        self.ANIMATION_INSTRUCTION,
-                        sub_instruction,
-                    ]
-                )
+        return {
+            "/".join([base_topic_for_light, instruction]): Route(
+                light_name, instruction, handler, slot
             )
-        return topics
+            for instruction, (handler, slot) in handlers.items()
+        }
 
     def mqtt_on_connect(self, client, userdata, flags, rc):
-        """Subscribe to relevant topics upon connection to MQTT server."""
-        for light_name in self.lights.keys():
-            for topic in self.get_topics_for_light(light_name):
-                log.info(f"Subscribed to '{topic}'")
-                client.subscribe(topic)
+        """Subscribe to relevant topics upon connection to MQTT server. All
+        topics are subscribed to in a single request.
+        """
+        client.subscribe(
+            [(topic, 0) for topic in self.routes.keys()]
+            + [(self.reload_topic, 0)]
+        )
+        log.info(
+            f"Subscribed to {len(self.routes)} topics for "
+            f"{len(self.lights)} lights"
+        )
 
     def animation_finished_callback(self, data):
         """Publish an MQTT message signalling that an animation has
@@ -137,61 +690,216 @@ class Maestro:
             payload=data["original_payload"],
         )
 
+    def load_start_payload(self, payload):
+        """Validate the JSON payload of an animation start message.
+
+        Validated payloads are memoised, as the same payload is often sent
+        many times. Each call returns a copy, which the caller is free to
+        modify.
+        """
+        return copy.deepcopy(_load_start_payload(payload))
+
+    def load_layer_payload(self, payload):
+        """Validate the JSON payload of a layer add message, memoised as
+        load_start_payload() is.
+        """
+        return copy.deepcopy(_load_layer_payload(payload))
+
     def mqtt_on_message(self, client, userdata, msg):
-        """Parse MQTT messages and perform the specified action."""
-        topic = msg.topic.split("/")
-        light_name, instruction = topic[1], topic[2]
-        light = self.lights[light_name]
-
-        # Instructions
-        if instruction == self.ON_INSTRUCTION:
-            log.info(f"Turning on '{light_name}'")
-            light.on()
-
-        elif instruction == self.OFF_INSTRUCTION:
-            log.info(f"Turning off '{light_name}'")
-            light.off()
-
-        elif instruction == self.ANIMATION_INSTRUCTION:
-            anim_instruction = topic[3]
-            payload = msg.payload.decode("utf-8")
-
-            # Start
-            if anim_instruction == self.ANIMATION_START:
-                try:
-                    validated_payload = self.animation_start_schema.loads(
-                        payload
-                    )
-                except ValidationError as e:
-                    log.error(e.messages)
-                    return
-                except JSONDecodeError as e:
-                    log.error(e)
-                    return
-
-                try:
-                    Animation = animations.get(validated_payload["animation"])
-                except ValueError as e:
-                    log.error(e)
-                    return
-
-                animation = Animation(light, validated_payload["config"])
-                log.info(
-                    f"Starting animation '{animation.name}' on '{light_name}'"  # noqa
-                )
-                light.start_animation(
-                    animation,
-                    callback=self.animation_finished_callback,
-                    callback_data={
-                        "light_name": light_name,
-                        "original_payload": payload,
-                    },
+        """Queue MQTT messages to be handled by the command queue workers.
+
+        This runs on the MQTT network thread so does as little as possible.
+        """
+        if msg.topic == self.reload_topic:
+            threading.Thread(target=self.reload_config).start()
+            return
+        route = self.routes.get(msg.topic)
+        if route is None:
+            log.error(f"Unexpected topic '{msg.topic}'")
+            return
+        self.command_queue.put(route.command(msg.payload))
+
+    def handle_command(self, command):
+        """Perform the action for a command."""
+        light = self.lights.get(command.light_name)
+        if light is None:
+            # The light was removed by a config reload
+            log.error(f"Unknown light '{command.light_name}'")
+            return
+        command.handler(light, command)
+
+    def handle_on(self, light, command):
+        log.info(f"Turning on '{command.light_name}'")
+        light.on()
+
+    def handle_off(self, light, command):
+        log.info(f"Turning off '{command.light_name}'")
+        light.off()
+
+    def handle_brightness(self, light, command):
+        try:
+            brightness = float(command.payload)
+        except ValueError:
+            log.error(f"Invalid brightness '{command.payload}'")
+            return
+        if not 0 <= brightness <= 1:
+            log.error("Brightness must be between 0 and 1")
+            return
+        log.info(
+            f"Setting brightness of '{command.light_name}' to {brightness}"
+        )
+        light.set_brightness(brightness)
+
+    def handle_animation_start(self, light, command):
+        light_name = command.light_name
+        payload = command.payload.decode("utf-8")
+
+        try:
+            validated_payload = self.load_start_payload(payload)
+        except ValidationError as e:
+            log.error(e.messages)
+            return
+        except JSONDecodeError as e:
+            log.error(e)
+            return
+
+        animation = self.create_animation(light, validated_payload)
+        if animation is None:
+            return
+        log.info(
+            f"Starting animation '{animation.name}' on '{light_name}'"  # noqa
+        )
+        light.start_animation(
+            animation,
+            callback=self.animation_finished_callback,
+            callback_data={
+                "light_name": light_name,
+                "original_payload": payload,
+            },
+        )
+
+    def create_animation(self, light, validated_payload):
+        """Create the animation described by a validated payload to run on
+        a light (or layer). Returns None, having logged why, if it can't be
+        created.
+        """
+        try:
+            Animation = animations.get(validated_payload["animation"])
+        except ValueError as e:
+            log.error(e)
+            return None
+
+        try:
+            if self.render_pool is not None and self.render_pool.accepts(
+                Animation
+            ):
+                # Validated here so that invalid configs are reported
+                # straight away
+                if Animation.config_schema is not None:
+                    Animation.load_config(validated_payload["config"])
+                return self.render_pool.create(
+                    validated_payload["animation"],
+                    light,
+                    validated_payload["config"],
                 )
+            animation = Animation(light, validated_payload["config"])
+        except ValidationError as e:
+            log.error(e.messages)
+            return None
+        except (OSError, ValueError) as e:
+            log.error(e)
+            return None
+        return self.frame_cache.wrap(
+            animation, light, validated_payload["config"]
+        )
 
-            # Stop
-            elif anim_instruction == self.ANIMATION_STOP:
-                log.info(f"Stopping animation on '{light_name}'")
-                light.stop_animation()
+    def handle_animation_stop(self, light, command):
+        log.info(f"Stopping animation on '{command.light_name}'")
+        light.stop_animation()
+
+    def handle_layer_add(self, light, command):
+        light_name = command.light_name
+        payload = command.payload.decode("utf-8")
+
+        try:
+            validated_payload = self.load_layer_payload(payload)
+        except ValidationError as e:
+            log.error(e.messages)
+            return
+        except JSONDecodeError as e:
+            log.error(e)
+            return
+
+        layer = Layer(
+            light,
+            validated_payload["layer"],
+            validated_payload["opacity"],
+            validated_payload["blend"],
+        )
+        animation = self.create_animation(layer, validated_payload)
+        if animation is None:
+            return
+        log.info(
+            f"Adding layer '{layer.name}' ({animation.name}) to "
+            f"'{light_name}'"
+        )
+        light.add_layer(
+            layer,
+            animation,
+            callback=self.animation_finished_callback,
+            callback_data={
+                "light_name": light_name,
+                "original_payload": payload,
+            },
+        )
+
+    def handle_layer_remove(self, light, command):
+        name = command.payload.decode("utf-8")
+        if light.remove_layer(name):
+            log.info(f"Removed layer '{name}' from '{command.light_name}'")
+        else:
+            log.error(f"No layer '{name}' on '{command.light_name}'")
+
+    def handle_profile(self, light, command):
+        light_name = command.light_name
+        try:
+            options = self.profile_schema.loads(command.payload or b"{}")
+        except ValidationError as e:
+            log.error(e.messages)
+            return
+        except JSONDecodeError as e:
+            log.error(e)
+            return
+
+        if not light.animating:
+            log.error(f"Nothing is running on '{light_name}' to profile")
+            return
+
+        profile_dir = self.config["profile_dir"] or tempfile.gettempdir()
+        path = os.path.join(
+            profile_dir,
+            f"{light_name}-{time.strftime('%Y%m%d-%H%M%S')}.prof",
+        )
+        topic = "/".join(
+            [
+                self.config["mqtt"]["base_topic"],
+                light_name,
+                self.PROFILE_INSTRUCTION,
+                "result",
+            ]
+        )
+        profiler = FrameProfiler(
+            options["frames"],
+            path,
+            options["top"],
+            callback=lambda summary: self.mqtt_client.publish(
+                topic, payload=json.dumps(summary)
+            ),
+        )
+        if not profiler.attach(light):
+            log.error(f"'{light_name}' is already being profiled")
+            return
+        log.info(f"Profiling {options['frames']} frames of '{light_name}'")
 
 
 if __name__ == "__main__":
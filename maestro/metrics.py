@@ -0,0 +1,265 @@
+"""Runtime metrics, exposed in the Prometheus text format over HTTP and
+published periodically over MQTT.
+
+Lights, connections and the command queue only count and observe as they go,
+which is cheap. Everything is aggregated when the metrics are collected, on
+the HTTP server's or publisher's own thread.
+"""
+
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logger import log
+
+# Upper bounds (in seconds) of the buckets of time histograms
+TIME_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+class Histogram:
+    """A histogram of observed values in fixed buckets, as Prometheus
+    histograms are.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus one for values over the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        """Return a snapshot with cumulative bucket counts, keyed by upper
+        bound.
+        """
+        counts = list(self.counts)
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": cumulative}
+
+
+# Name, type, help and key in Light.stats() of each per-light metric
+_LIGHT_METRICS = [
+    ("frames_total", "counter", "Frames rendered.", "frames"),
+    (
+        "frames_dropped_total",
+        "counter",
+        "Frames dropped because rendering fell behind.",
+        "dropped_frames",
+    ),
+    (
+        "frames_skipped_total",
+        "counter",
+        "Frames not sent because they were unchanged.",
+        "skipped_frames",
+    ),
+    ("fps", "gauge", "Achieved frames per second.", "achieved_fps"),
+    (
+        "target_fps",
+        "gauge",
+        "Frames per second rendered at, after any lowering under load.",
+        "target_fps",
+    ),
+    ("bytes_sent_total", "counter", "Bytes sent.", "bytes_sent"),
+    ("packets_sent_total", "counter", "Packets sent.", "packets_sent"),
+    ("send_errors_total", "counter", "Failed sends.", "send_errors"),
+    ("layers", "gauge", "Layers over the animation.", "layers"),
+]
+
+_COMMAND_METRICS = [
+    ("commands_received_total", "counter", "Commands received.", "received"),
+    (
+        "commands_coalesced_total",
+        "counter",
+        "Commands superseded before being handled.",
+        "coalesced",
+    ),
+    ("commands_handled_total", "counter", "Commands handled.", "handled"),
+    ("commands_pending", "gauge", "Commands waiting.", "depth"),
+]
+
+
+def _labels(**labels):
+    return ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in labels.items()
+    )
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    for bound, count in histogram["buckets"].items():
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+    lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+    return lines
+
+
+def collect(lights, command_queue=None):
+    """Return the stats of every light (as returned by Light.stats(), plus
+    its command metrics), keyed by light name.
+    """
+    commands = {}
+    if command_queue is not None:
+        commands = command_queue.metrics()["lights"]
+    stats = {}
+    for name, light in lights.items():
+        stats[name] = light.stats()
+        if name in commands:
+            stats[name]["commands"] = commands[name]
+    return stats
+
+
+def prometheus(stats, prefix="maestro"):
+    """Format collected stats in the Prometheus text format."""
+    lines = []
+
+    for metric, metric_type, help_text, key in _LIGHT_METRICS:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {metric_type}")
+        for name, light_stats in stats.items():
+            lines.append(
+                f"{prefix}_{metric}{{{_labels(light=name)}}} "
+                f"{light_stats[key]}"
+            )
+
+    lines.append(f"# HELP {prefix}_animation Animation running on a light.")
+    lines.append(f"# TYPE {prefix}_animation gauge")
+    for name, light_stats in stats.items():
+        if light_stats["animation"] is not None:
+            labels = _labels(light=name, animation=light_stats["animation"])
+            lines.append(f"{prefix}_animation{{{labels}}} 1")
+
+    lines.append(f"# HELP {prefix}_render_seconds Time to render a frame.")
+    lines.append(f"# TYPE {prefix}_render_seconds histogram")
+    for name, light_stats in stats.items():
+        lines.extend(
+            _histogram_lines(
+                f"{prefix}_render_seconds",
+                _labels(light=name),
+                light_stats["render_time"],
+            )
+        )
+
+    for metric, metric_type, help_text, key in _COMMAND_METRICS:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} {metric_type}")
+        for name, light_stats in stats.items():
+            if "commands" in light_stats:
+                lines.append(
+                    f"{prefix}_{metric}{{{_labels(light=name)}}} "
+                    f"{light_stats['commands'][key]}"
+                )
+
+    lines.append(
+        f"# HELP {prefix}_command_latency_seconds Time from an MQTT message "
+        "being received to its command being handled."
+    )
+    lines.append(f"# TYPE {prefix}_command_latency_seconds histogram")
+    for name, light_stats in stats.items():
+        if "commands" in light_stats:
+            lines.extend(
+                _histogram_lines(
+                    f"{prefix}_command_latency_seconds",
+                    _labels(light=name),
+                    light_stats["commands"]["latency"],
+                )
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics of every light in the Prometheus text format, at
+    any path, from a background thread.
+    """
+
+    def __init__(self, host, port, collect):
+        self._collect = collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                body = prometheus(self._collect()).encode("utf-8")
+                handler.send_response(200)
+                handler.send_header(
+                    "Content-Type", "text/plain; version=0.0.4"
+                )
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        ).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StatsPublisher:
+    """Publishes the stats of each light as JSON every interval seconds, from
+    a background thread.
+    """
+
+    def __init__(self, interval, collect, publish):
+        self.interval = interval
+        self._collect = collect
+        self._publish = publish
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            if self._stopped.wait(max(0.0, deadline - time.monotonic())):
+                return
+            try:
+                for name, light_stats in self._collect().items():
+                    self._publish(name, json.dumps(light_stats))
+            except Exception:
+                log.exception("Failed to publish stats")
@@ -0,0 +1,82 @@
+class OutputStage:
+    """Master brightness, gamma and white balance correction for a light.
+
+    The corrections are precomputed into a 256 entry lookup table per colour
+    channel, which is then applied to a whole frame at once as it is sent.
+    Changing a setting only rebuilds the tables.
+    """
+
+    def __init__(self, brightness=1, gamma=1, white_balance=(1, 1, 1)):
+        self._brightness = brightness
+        self._gamma = gamma
+        self._white_balance = tuple(white_balance)
+        self._build_tables()
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        self._brightness = value
+        self._build_tables()
+
+    @property
+    def gamma(self):
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, value):
+        self._gamma = value
+        self._build_tables()
+
+    @property
+    def white_balance(self):
+        return self._white_balance
+
+    @white_balance.setter
+    def white_balance(self, value):
+        self._white_balance = tuple(value)
+        self._build_tables()
+
+    @property
+    def is_identity(self):
+        """True if the stage leaves every value unchanged."""
+        return self._tables is None
+
+    def _build_tables(self):
+        tables = tuple(
+            bytes(
+                round(
+                    255
+                    * ((value / 255) ** self._gamma)
+                    * self._brightness
+                    * balance
+                )
+                for value in range(256)
+            )
+            for balance in self._white_balance
+        )
+        if all(table == _IDENTITY for table in tables):
+            tables = None
+        elif tables[0] == tables[1] == tables[2]:
+            tables = tables[0]
+        # Replaced in a single assignment so a frame being sent on another
+        # thread never sees a partially built set of tables.
+        self._tables = tables
+
+    def apply(self, pixels, out):
+        """Write the corrected RGB data for pixels into out."""
+        tables = self._tables
+        if tables is None:
+            out[:] = pixels
+        elif isinstance(tables, bytes):
+            out[:] = bytes(pixels).translate(tables)
+        else:
+            for channel in range(3):
+                out[channel::3] = bytes(pixels[channel::3]).translate(
+                    tables[channel]
+                )
+
+
+_IDENTITY = bytes(range(256))
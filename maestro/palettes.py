@@ -0,0 +1,283 @@
+"""Palettes: gradients of colours baked into lookup tables.
+
+A palette is a table of 256 colours, interpolated from a list of colours
+(stops) in RGB or HSV. Drawing with a palette is then a table lookup per LED,
+done for the whole strip at once with bytes.translate(), so animations can
+fill a strip with a rainbow or scroll a gradient along it without any
+colour maths per LED.
+
+Palettes are registered by name. Built in palettes can be added to, or
+replaced, by the palettes section of the config. Animation configs can use
+a palette by name or define one inline (see PaletteField).
+"""
+
+import colorsys
+import functools
+
+from marshmallow import (
+    Schema,
+    ValidationError,
+    fields,
+    validate,
+    validates_schema,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SIZE = 256
+COLOUR_SPACES = ("rgb", "hsv")
+
+
+class Palette:
+    """A table of 256 colours."""
+
+    def __init__(self, colours):
+        colours = [tuple(colour) for colour in colours]
+        if len(colours) != SIZE:
+            raise ValueError(f"A palette needs {SIZE} colours")
+        self.colours = colours
+        # One table per channel, for bytes.translate()
+        self.channels = tuple(
+            bytes(colour[channel] for colour in colours)
+            for channel in range(3)
+        )
+        self._array = None
+
+    @classmethod
+    def gradient(cls, colours, positions=None, space="rgb", wrap=False):
+        """Interpolate a palette from colours at positions between 0 and 1
+        (evenly spaced by default). A wrapped palette blends from the last
+        colour back to the first, so it can be scrolled without a seam.
+        """
+        if positions is None:
+            count = len(colours) if wrap else len(colours) - 1
+            positions = [idx / max(count, 1) for idx in range(len(colours))]
+        stops = list(zip(positions, colours))
+        if len(stops) == 1:
+            return cls([stops[0][1]] * SIZE)
+        if wrap:
+            stops.append((stops[0][0] + 1, stops[0][1]))
+        interpolate = _interpolate_hsv if space == "hsv" else _interpolate_rgb
+
+        table = []
+        stop = 0
+        for idx in range(SIZE):
+            position = idx / SIZE if wrap else idx / (SIZE - 1)
+            if position < stops[0][0]:
+                table.append(stops[0][1])
+                continue
+            while stop < len(stops) - 2 and position > stops[stop + 1][0]:
+                stop += 1
+            (start, start_rgb), (end, end_rgb) = stops[stop], stops[stop + 1]
+            if position >= end or end == start:
+                table.append(end_rgb if position >= end else start_rgb)
+                continue
+            table.append(
+                interpolate(
+                    start_rgb, end_rgb, (position - start) / (end - start)
+                )
+            )
+        return cls(table)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a palette from a config validated by PaletteSchema."""
+        return cls.gradient(
+            config["colours"],
+            config["positions"],
+            config["space"],
+            config["wrap"],
+        )
+
+    def colour(self, index):
+        """Return the [r, g, b] colour at an index, which wraps round."""
+        return list(self.colours[index % SIZE])
+
+    @property
+    def array(self):
+        """The colours as a 256x3 NumPy array."""
+        if self._array is None:
+            self._array = numpy.array(self.colours, dtype=numpy.uint8)
+        return self._array
+
+    def rotated_channels(self, offset):
+        """The channel tables starting offset colours into the palette."""
+        offset %= SIZE
+        return tuple(
+            table[offset:] + table[:offset] for table in self.channels
+        )
+
+    def __deepcopy__(self, memo):
+        # Palettes never change, so copies of configs can share them
+        return self
+
+    def __repr__(self):
+        return f"Palette({b''.join(self.channels).hex()})"
+
+
+def _interpolate_rgb(start, end, fraction):
+    return tuple(round(a + (b - a) * fraction) for a, b in zip(start, end))
+
+
+def _interpolate_hsv(start, end, fraction):
+    h1, s1, v1 = colorsys.rgb_to_hsv(*(c / 255 for c in start))
+    h2, s2, v2 = colorsys.rgb_to_hsv(*(c / 255 for c in end))
+    # Greys have no hue, and black no saturation either, so take the other
+    # colour's
+    if v1 == 0:
+        s1 = s2
+    if v2 == 0:
+        s2 = s1
+    if s1 == 0:
+        h1 = h2
+    if s2 == 0:
+        h2 = h1
+    # Go round the shorter way
+    if h2 - h1 > 0.5:
+        h1 += 1
+    elif h1 - h2 > 0.5:
+        h2 += 1
+    rgb = colorsys.hsv_to_rgb(
+        (h1 + (h2 - h1) * fraction) % 1,
+        s1 + (s2 - s1) * fraction,
+        v1 + (v2 - v1) * fraction,
+    )
+    return tuple(round(c * 255) for c in rgb)
+
+
+@functools.lru_cache(maxsize=64)
+def spread(count, repeat=1):
+    """Return the palette index of each of count LEDs, so the palette is
+    spread evenly across them repeat times.
+    """
+    return bytes((idx * SIZE * repeat // count) % SIZE for idx in range(count))
+
+
+class PaletteSchema(Schema):
+    """Schema for a palette defined in the config or an MQTT payload."""
+
+    colours = fields.List(
+        fields.List(
+            fields.Int(validate=validate.Range(min=0, max=255)),
+            validate=validate.Length(equal=3),
+        ),
+        validate=validate.Length(min=1),
+        required=True,
+    )
+    # Defaults to evenly spaced
+    positions = fields.List(
+        fields.Float(validate=validate.Range(min=0, max=1)), missing=None
+    )
+    space = fields.String(
+        validate=validate.OneOf(COLOUR_SPACES), missing="rgb"
+    )
+    wrap = fields.Boolean(missing=False)
+
+    @validates_schema
+    def validate_positions(self, data, **kwargs):
+        positions = data.get("positions")
+        if positions is None:
+            return
+        if len(positions) != len(data["colours"]):
+            raise ValidationError(
+                "There must be a position for each colour", "positions"
+            )
+        if positions != sorted(positions):
+            raise ValidationError(
+                "Positions must be in increasing order", "positions"
+            )
+
+
+class PaletteField(fields.Field):
+    """A palette in an animation config: either the name of a registered
+    palette or a palette definition. Deserialises to the name or Palette,
+    either of which can be passed to get().
+    """
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, str):
+            if _key(value) not in _registry:
+                raise ValidationError(f"Unknown palette '{value}'")
+            return value
+        if isinstance(value, dict):
+            return Palette.from_config(PaletteSchema().load(value))
+        raise ValidationError("Must be a palette name or definition")
+
+
+_registry = {}
+
+
+def _key(name):
+    return name.lower().replace("_", "")
+
+
+def register(name, palette):
+    """Register a palette by name, replacing any with the same name. Names
+    are matched as animation names are.
+    """
+    _registry[_key(name)] = palette
+
+
+def configure(configs):
+    """Register the built in palettes and those in the config (validated by
+    PaletteSchema, by name), dropping any registered before.
+    """
+    _registry.clear()
+    for name, palette in BUILT_IN.items():
+        register(name, palette)
+    for name, config in configs.items():
+        register(name, Palette.from_config(config))
+
+
+def get(palette):
+    """Return a palette given its name, or the palette itself.
+
+    Raises a ValueError if there's no palette with the name.
+    """
+    if isinstance(palette, Palette):
+        return palette
+    found = _registry.get(_key(palette))
+    if found is None:
+        raise ValueError(f"Unknown palette '{palette}'")
+    return found
+
+
+def _heat_colour(temperature):
+    # From Fire (see animations/fire.py)
+
+    # Scale 'heat' down from 0-255 to 0-191
+    t192 = round((temperature / 255) * 191)
+
+    # calculate ramp up from
+    heatramp = t192 & 63
+    heatramp <<= 2  # scale up to 0..252
+
+    # figure out which third of the spectrum we're in:
+    if t192 > 128:  # hottest
+        return [255, 255, heatramp]
+    elif t192 > 64:  # middle
+        return [255, heatramp, 0]
+    else:  # coolest
+        return [heatramp, 0, 0]
+
+
+BUILT_IN = {
+    "heat": Palette([_heat_colour(t) for t in range(SIZE)]),
+    "rainbow": Palette.gradient(
+        [(255, 0, 0), (0, 255, 0), (0, 0, 255)], space="hsv", wrap=True
+    ),
+    "ocean": Palette.gradient(
+        [(0, 0, 32), (0, 64, 160), (0, 160, 200), (160, 255, 255)]
+    ),
+    "lava": Palette.gradient(
+        [(0, 0, 0), (128, 0, 0), (255, 64, 0), (255, 200, 0), (255, 255, 255)]
+    ),
+    "forest": Palette.gradient(
+        [(0, 32, 0), (0, 128, 0), (96, 160, 0), (32, 96, 32)], wrap=True
+    ),
+}
+
+configure({})
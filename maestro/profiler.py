@@ -0,0 +1,130 @@
+"""On-demand profiling of the frames rendered for a light.
+
+A FrameProfiler is attached to a light for a number of frames. While
+attached, it stands in for the light's _render_frame() method, so each frame
+(stepping the animation and layers, then compositing, encoding and sending
+the frame) is run under cProfile. Once detached the light renders as it did
+before, with nothing left in the render loop.
+"""
+
+import cProfile
+import io
+import pstats
+import threading
+
+from logger import log
+
+
+class FrameProfiler:
+    """Profiles the next frames of a light and writes the profile, in the
+    pstats format, to a file. Profiling ends after that many frames, or sooner
+    if the animation finishes, is stopped or is replaced.
+    """
+
+    def __init__(self, frames, path, top=20, callback=None):
+        self.frames = frames
+        self.path = path
+        self.top = top
+        # Called with the summary once the profile has been written
+        self.callback = callback
+        self.profiled_frames = 0
+        self._profile = cProfile.Profile()
+        self._light = None
+        self._detach_lock = threading.Lock()
+
+    def attach(self, light):
+        """Start profiling the frames of a light. Returns False if the light
+        is already being profiled.
+        """
+        if "_render_frame" in vars(light):
+            return False
+        render_frame = light._render_frame
+
+        def profiled_render_frame(cancelled, batch=None):
+            try:
+                self._profile.enable()
+            except ValueError:
+                # From Python 3.12 only one profiler can be enabled at a time,
+                # so while another is, the light can't be profiled at all
+                self._detach(error="Another profiler is already running")
+                return render_frame(cancelled, batch)
+            try:
+                done = render_frame(cancelled, batch)
+            finally:
+                self._profile.disable()
+            self.profiled_frames += 1
+            if (
+                done
+                or cancelled.is_set()
+                or self.profiled_frames >= self.frames
+            ):
+                self._detach()
+            return done
+
+        self._light = light
+        light._render_frame = profiled_render_frame
+        light.add_stop_hook(self._detach)
+        return True
+
+    def _detach(self, error=None):
+        # Called from the render loop or when the animation is stopped,
+        # whichever is first
+        with self._detach_lock:
+            light, self._light = self._light, None
+        if light is None:
+            return
+        del light._render_frame
+        light.remove_stop_hook(self._detach)
+        if error is None and self.profiled_frames == 0:
+            error = "The animation stopped before any frames were profiled"
+        if error is not None:
+            log.warning(f"Failed to profile light: {error}")
+            target, args = self._fail, (error,)
+        else:
+            target, args = self._finish, ()
+        # Writing the profile (and calling back) is left to another thread so
+        # the render loop isn't held up
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    def _fail(self, error):
+        if self.callback is not None:
+            self.callback(
+                {"frames": self.profiled_frames, "path": None, "error": error}
+            )
+
+    def _finish(self):
+        try:
+            self._profile.dump_stats(self.path)
+            summary = self.summary()
+        except Exception:
+            log.exception("Failed to write profile")
+            return
+        log.info(
+            f"Wrote profile of {self.profiled_frames} frames to '{self.path}'"
+        )
+        if self.callback is not None:
+            self.callback(summary)
+
+    def summary(self):
+        """Return the number of frames profiled, where the profile was
+        written and the top functions by cumulative time.
+        """
+        stats = pstats.Stats(self._profile, stream=io.StringIO())
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+        functions = []
+        for func in stats.fcn_list[: self.top]:
+            calls, _, total_time, cumulative_time, _ = stats.stats[func]
+            file_name, line, name = func
+            functions.append(
+                {
+                    "function": f"{file_name}:{line}({name})",
+                    "calls": calls,
+                    "total_time": total_time,
+                    "cumulative_time": cumulative_time,
+                }
+            )
+        return {
+            "frames": self.profiled_frames,
+            "path": self.path,
+            "functions": functions,
+        }
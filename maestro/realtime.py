@@ -0,0 +1,179 @@
+"""Encoders for the WLED UDP realtime protocols.
+
+https://github.com/Aircoookie/WLED/wiki/UDP-Realtime-Control
+
+Every encoder returns a list of packets, where each packet is a list of
+buffers to be sent together as a single datagram. This allows the pixel data
+to be sent straight from the frame buffer without being copied.
+"""
+
+import math
+
+WARLS = 1
+DRGB = 2
+DNRGB = 4
+
+PROTOCOLS = {
+    "auto": None,
+    "warls": WARLS,
+    "drgb": DRGB,
+    "dnrgb": DNRGB,
+}
+
+DRGB_MAX_LEDS = 490
+DNRGB_MAX_LEDS = 489
+WARLS_MAX_LEDS = 256  # LED indexes are a single byte
+WARLS_MAX_LEDS_PER_PACKET = 367  # Keeps packets under a typical 1472 MTU
+
+# Maps every non-zero byte to 1
+_NONZERO = bytes([0] + [1] * 255)
+
+
+def validate(protocol, num_leds):
+    """Raise a ValueError if a protocol name is unknown or can't be used for
+    a light with the given number of LEDs.
+    """
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"Unknown protocol '{protocol}'")
+    if protocol == "drgb" and num_leds > DRGB_MAX_LEDS:
+        raise ValueError(f"DRGB supports a maximum of {DRGB_MAX_LEDS} LEDs")
+    if protocol == "warls" and num_leds > WARLS_MAX_LEDS:
+        raise ValueError(f"WARLS supports a maximum of {WARLS_MAX_LEDS} LEDs")
+
+
+def drgb(frame):
+    """Encode a DRGB frame. The frame must be the full buffer including the
+    DRGB header.
+    """
+    return [[frame]]
+
+
+def dnrgb(timeout, pixels, first_led, last_led):
+    """Encode the LEDs from first_led to last_led (inclusive) as DNRGB
+    packets.
+    """
+    packets = []
+    for start in range(first_led, last_led + 1, DNRGB_MAX_LEDS):
+        end = min(start + DNRGB_MAX_LEDS, last_led + 1)
+        header = bytes([DNRGB, timeout, start >> 8, start & 0xFF])
+        packets.append([header, pixels[start * 3 : end * 3]])
+    return packets
+
+
+def warls(timeout, pixels, leds):
+    """Encode the given LED indexes as WARLS packets."""
+    packets = []
+    for start in range(0, len(leds), WARLS_MAX_LEDS_PER_PACKET):
+        packet = bytearray([WARLS, timeout])
+        for led in leds[start : start + WARLS_MAX_LEDS_PER_PACKET]:
+            packet.append(led)
+            packet += pixels[led * 3 : led * 3 + 3]
+        packets.append([packet])
+    return packets
+
+
+def size(packets):
+    return sum(len(buffer) for packet in packets for buffer in packet)
+
+
+def _drgb_size(num_leds):
+    if num_leds > DRGB_MAX_LEDS:
+        return math.inf
+    return 2 + (num_leds * 3)
+
+
+def _dnrgb_size(num_leds):
+    return (num_leds * 3) + (4 * math.ceil(num_leds / DNRGB_MAX_LEDS))
+
+
+def _warls_size(num_leds):
+    return (num_leds * 4) + (
+        2 * math.ceil(num_leds / WARLS_MAX_LEDS_PER_PACKET)
+    )
+
+
+def _diff_mask(pixels, previous):
+    """Return a bytes object with a 1 for every byte that differs between the
+    two buffers and a 0 for every byte that doesn't.
+    """
+    diff = int.from_bytes(pixels, "little") ^ int.from_bytes(
+        previous, "little"
+    )
+    return diff.to_bytes(len(pixels), "little").translate(_NONZERO)
+
+
+def changed_range(pixels, previous):
+    """Return the range of LEDs (first, end) that differ between the two
+    buffers, or None if they are the same.
+    """
+    diff = int.from_bytes(pixels, "little") ^ int.from_bytes(
+        previous, "little"
+    )
+    if diff == 0:
+        return None
+    first_byte = ((diff & -diff).bit_length() - 1) // 8
+    last_byte = (diff.bit_length() - 1) // 8
+    return first_byte // 3, last_byte // 3 + 1
+
+
+def _changed_leds(mask, limit):
+    """Return the indexes of the LEDs flagged in a diff mask, or None if there
+    are more than limit of them.
+    """
+    leds = []
+    pos = mask.find(1)
+    while pos != -1:
+        if len(leds) == limit:
+            return None
+        led = pos // 3
+        leds.append(led)
+        pos = mask.find(1, (led + 1) * 3)
+    return leds
+
+
+def encode(protocol, frame, pixels, timeout, previous=None):
+    """Encode a frame as packets using the given protocol (one of the values
+    in PROTOCOLS).
+
+    If the previously sent pixels are given then only the LEDs that have
+    changed are sent, where the protocol allows it. With the "auto" protocol,
+    whichever encoding results in the fewest bytes is used.
+    """
+    num_leds = len(pixels) // 3
+
+    if previous is None:
+        if protocol == "warls":
+            return warls(timeout, pixels, range(num_leds))
+        if protocol == "dnrgb" or num_leds > DRGB_MAX_LEDS:
+            return dnrgb(timeout, pixels, 0, num_leds - 1)
+        return drgb(frame)
+
+    if protocol == "drgb":
+        return drgb(frame)
+
+    mask = _diff_mask(pixels, previous)
+    first = mask.find(1)
+    if first == -1:
+        return []
+    first_led = first // 3
+    last_led = mask.rfind(1) // 3
+
+    if protocol == "warls":
+        return warls(timeout, pixels, _changed_leds(mask, num_leds))
+    if protocol == "dnrgb":
+        return dnrgb(timeout, pixels, first_led, last_led)
+
+    # Auto
+    drgb_size = _drgb_size(num_leds)
+    dnrgb_size = _dnrgb_size(last_led - first_led + 1)
+    if last_led < WARLS_MAX_LEDS:
+        # Only look for as many changed LEDs as could make WARLS the smallest
+        limit = (min(drgb_size, dnrgb_size) - 1) // 4
+        leds = _changed_leds(mask, limit)
+        if leds is not None and _warls_size(len(leds)) < min(
+            drgb_size, dnrgb_size
+        ):
+            return warls(timeout, pixels, leds)
+    if drgb_size <= dnrgb_size:
+        return drgb(frame)
+    return dnrgb(timeout, pixels, first_led, last_led)
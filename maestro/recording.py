@@ -0,0 +1,119 @@
+"""Record an animation to a frame file, to be played back with the Replay
+animation.
+
+A frame file is a 16 byte header (see HEADER) followed by the raw RGB data of
+each frame, three bytes per LED. For example:
+
+    python recording.py bouncing_ball --num-leds 100 --fps 30 \\
+        --config '{"bounciness": 0.9}' --output bouncing_ball.frames
+"""
+
+import argparse
+import json
+import mmap
+import struct
+
+import animations
+from light import Light, NullSink
+
+MAGIC = b"MSTR"
+VERSION = 1
+# Magic, version, number of LEDs, fps, number of frames
+HEADER = struct.Struct("<4sHIHI")
+
+
+class Recording:
+    """A frame file opened for playback. Frames are read from a read-only
+    memory map, so only the frames played are paged in.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header(path)
+        except ValueError:
+            self._mmap.close()
+            raise
+        self._frames = memoryview(self._mmap)[HEADER.size :]
+
+    def _read_header(self, path):
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"'{path}' is not a frame file")
+        magic, version, num_leds, fps, frame_count = HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' is not a frame file")
+
+        self.num_leds = num_leds
+        self.fps = fps
+        self.frame_count = frame_count
+        self.frame_size = num_leds * 3
+        if len(self._mmap) < HEADER.size + (frame_count * self.frame_size):
+            raise ValueError(f"'{path}' is truncated")
+
+    def frame(self, idx):
+        """Return a memoryview of the RGB data of a frame."""
+        start = idx * self.frame_size
+        return self._frames[start : start + self.frame_size]
+
+    def close(self):
+        self._frames.release()
+        self._mmap.close()
+
+
+def record(animation_cls, config, num_leds, fps, path, max_frames=None):
+    """Render an animation offline and write it to a frame file.
+
+    Rendering stops when the animation finishes or after max_frames frames,
+    which must be given for animations that never finish. Returns the number
+    of frames written.
+    """
+    light = Light("0.0.0.0", 0, num_leds, fps, sock=NullSink())
+    animation = animation_cls(light, config)
+    elapsed = 1 / fps
+
+    frame_count = 0
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, num_leds, fps, 0))
+        while max_frames is None or frame_count < max_frames:
+            finished = animation.advance(elapsed)
+            f.write(light.pixels)
+            frame_count += 1
+            if finished is True:
+                break
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, num_leds, fps, frame_count))
+    return frame_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("animation")
+    parser.add_argument("--num-leds", type=int, required=True)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument(
+        "--config", type=json.loads, default={}, help="JSON config."
+    )
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        help="Required for animations that never finish.",
+    )
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    frame_count = record(
+        animations.get(args.animation),
+        args.config,
+        args.num_leds,
+        args.fps,
+        args.output,
+        args.max_frames,
+    )
+    print(f"Recorded {frame_count} frames to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
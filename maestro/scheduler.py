@@ -0,0 +1,185 @@
+import math
+import time
+from collections import deque
+
+from metrics import Histogram
+
+
+class FrameStats:
+    """Rolling frame timing statistics for a single light."""
+
+    def __init__(self, window=120):
+        self.frames = 0
+        self.dropped_frames = 0
+        # Frames not sent as they were unchanged
+        self.skipped_frames = 0
+        self.render_time_histogram = Histogram()
+        self._frame_starts = deque(maxlen=window)
+        self._render_times = deque(maxlen=window)
+        self._jitters = deque(maxlen=window)
+
+    def record(self, started, render_time, jitter):
+        self.frames += 1
+        self._frame_starts.append(started)
+        self._render_times.append(render_time)
+        self._jitters.append(jitter)
+        self.render_time_histogram.observe(render_time)
+
+    @property
+    def achieved_fps(self):
+        if len(self._frame_starts) < 2:
+            return 0.0
+        elapsed = self._frame_starts[-1] - self._frame_starts[0]
+        if elapsed <= 0:
+            return 0.0
+        return (len(self._frame_starts) - 1) / elapsed
+
+    def as_dict(self):
+        """Return a snapshot of the statistics. Times are in seconds."""
+        render_times = list(self._render_times)
+        jitters = list(self._jitters)
+        return {
+            "frames": self.frames,
+            "dropped_frames": self.dropped_frames,
+            "skipped_frames": self.skipped_frames,
+            "achieved_fps": self.achieved_fps,
+            "render_time_mean": _mean(render_times),
+            "render_time_max": max(render_times, default=0.0),
+            "jitter_mean": _mean(jitters),
+            "jitter_max": max(jitters, default=0.0),
+            "render_time": self.render_time_histogram.as_dict(),
+        }
+
+
+class FrameGovernor:
+    """Adapts the fps of a schedule to how long frames take to render.
+
+    The fps is lowered, down to min_fps, while rendering takes most of the
+    frame period or frames are being dropped, and raised again, up to
+    max_fps, once rendering has plenty of headroom. Time-based animations
+    run at the same speed whatever the fps, so under load a light renders
+    fewer frames rather than falling behind.
+    """
+
+    # Fraction of the frame period that rendering may take before the fps is
+    # lowered, and must stay under for the fps to be raised
+    HIGH_LOAD = 0.8
+    LOW_LOAD = 0.4
+    DECREASE = 0.8
+    INCREASE = 1.1
+    # Seconds between adjustments
+    HOLD = 1.0
+    # Weight of each frame in the moving average of render times
+    SMOOTHING = 0.1
+
+    def __init__(self, max_fps, min_fps):
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.fps = max_fps
+        self._render_time = None
+        self._adjusted_at = None
+
+    def update(self, now, render_time, dropped):
+        """Record a frame's render time and whether frames were dropped after
+        it. Returns the fps to render at.
+        """
+        if self._render_time is None:
+            self._render_time = render_time
+            self._adjusted_at = now
+        else:
+            self._render_time += (
+                render_time - self._render_time
+            ) * self.SMOOTHING
+        if now - self._adjusted_at < self.HOLD:
+            return self.fps
+
+        load = self._render_time * self.fps
+        if (dropped or load > self.HIGH_LOAD) and self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps * self.DECREASE)
+            self._adjusted_at = now
+        elif load < self.LOW_LOAD and self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps * self.INCREASE)
+            self._adjusted_at = now
+        return self.fps
+
+
+class FrameScheduler:
+    """Schedules frames against absolute deadlines on a monotonic clock.
+
+    Each frame is due exactly one frame period after the previous deadline,
+    regardless of how long rendering took, so the configured fps is the fps
+    that is actually achieved. A frame that is late, but by less than a frame
+    period, is rendered straight away to catch up. If the scheduler falls a
+    whole frame period or more behind, the missed frames are dropped rather
+    than the schedule drifting.
+
+    If a governor is given, it sets the fps from frame to frame.
+    """
+
+    def __init__(self, fps, stats=None, governor=None):
+        self.fps = fps
+        self.stats = stats if stats is not None else FrameStats()
+        self.governor = governor
+        self._deadline = None
+
+    @property
+    def period(self):
+        return 1 / self.fps
+
+    @property
+    def deadline(self):
+        """The monotonic time at which the next frame is due."""
+        return self._deadline
+
+    def reset(self, fps=None, epoch=None):
+        """Start a new schedule with the first frame due now.
+
+        If an epoch is given the schedule is aligned to a grid of frame
+        periods counted from it, with the first frame due on the next grid
+        point. Schedules sharing an epoch and fps therefore fall due together.
+        """
+        if fps is not None:
+            self.fps = fps
+        now = time.monotonic()
+        if epoch is None:
+            self._deadline = now
+        else:
+            period = self.period
+            self._deadline = epoch + math.ceil((now - epoch) / period) * period
+        return self._deadline
+
+    def begin_frame(self):
+        """Mark the start of a frame. Returns the start time to be passed to
+        end_frame().
+        """
+        if self._deadline is None:
+            self.reset()
+        return time.monotonic()
+
+    def end_frame(self, started):
+        """Mark the end of a frame and return the number of seconds to wait
+        before the next frame is due.
+        """
+        now = time.monotonic()
+        period = self.period
+        render_time = now - started
+        self.stats.record(
+            started, render_time, max(0.0, started - self._deadline)
+        )
+
+        self._deadline += period
+        missed = 0
+        if now > self._deadline:
+            missed = int((now - self._deadline) / period)
+            if missed > 0:
+                self._deadline += missed * period
+                self.stats.dropped_frames += missed
+        if self.governor is not None:
+            self.fps = self.governor.update(now, render_time, missed > 0)
+        return max(0.0, self._deadline - now)
+
+
+def _mean(values):
+    if not values:
+        return 0.0
+    return sum(values) / len(values)
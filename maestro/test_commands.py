@@ -0,0 +1,27 @@
+import threading
+
+from commands import Command, CommandQueue
+
+
+def test_replaced_command_is_handled_in_arrival_order():
+    handled = []
+    done = threading.Event()
+    blocked = threading.Event()
+
+    def handler(command):
+        if command.instruction == "block":
+            blocked.wait(5)
+        handled.append(command.instruction)
+        if command.instruction == "off":
+            done.set()
+
+    queue = CommandQueue(handler)
+    # Hold the worker so the following commands are all pending together
+    queue.put(Command("light", "block", None, None, None))
+    queue.put(Command("light", "animation/stop", None, "state", None))
+    queue.put(Command("light", "layer/add", None, None, None))
+    queue.put(Command("light", "off", None, "state", None))
+    blocked.set()
+
+    assert done.wait(5)
+    assert handled == ["block", "layer/add", "off"]
@@ -0,0 +1,346 @@
+"""Sending packets to light controllers over UDP.
+
+Each light has a Connection, a UDP socket connect()ed to the resolved address
+of its controller. On Linux, the packets of several lights can also be
+collected in a Batch and sent with a single sendmmsg() call.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import socket
+import sys
+import time
+from threading import Lock, Thread
+
+from logger import log
+
+
+class Connection:
+    """A UDP socket connected to a light's controller.
+
+    The host is resolved, on a background thread, when the first packet is
+    sent and the socket is connect()ed to the result. Packets are sent to the
+    last address resolved, so sending never waits for the host to be
+    resolved. It is resolved again every resolve_interval seconds, and
+    straight away after a send fails. Packets sent before the host is first
+    resolved are dropped, after which on_resolved is called (from the
+    resolving thread).
+
+    If a socket (or anything with a sendmsg() or sendto() method) is given it
+    is used as-is: packets are sent to the host and port unresolved.
+    """
+
+    # Seconds between attempts while resolving or sending is failing
+    RETRY_INTERVAL = 5
+
+    def __init__(
+        self, host, port, resolve_interval=300, sock=None, on_resolved=None
+    ):
+        self.host = host
+        self.port = port
+        self.resolve_interval = resolve_interval
+        self.address = None
+        self.family = None
+        # A struct sockaddr of the address, for batched sends
+        self.sockaddr = None
+        self._sock = sock
+        self._custom_sock = sock is not None
+        self.on_resolved = on_resolved
+        self._resolve_at = 0
+        self._resolving = False
+        # Held while the socket is connected to a new address or closed
+        self._lock = Lock()
+        self._failing = False
+        self._failed_at = None
+        # Once closed, nothing more is sent
+        self.closed = False
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+
+    @property
+    def ready(self):
+        """Whether packets can be sent: the connection isn't closed, and the
+        host has been resolved or a socket was given.
+        """
+        return self.closed is False and (
+            self._custom_sock or self.address is not None
+        )
+
+    def resolve(self, now=None):
+        """Start resolving the host in the background if due. Returns True
+        if there is an address to send to.
+        """
+        if self._custom_sock or self.closed:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now >= self._resolve_at and self._resolving is False:
+            self._resolve_at = now + self.RETRY_INTERVAL
+            self._resolving = True
+            Thread(target=self._resolve, daemon=True).start()
+        return self.address is not None
+
+    def _resolve(self):
+        # Resolving can take as long as the resolver's timeout, so it is
+        # never done while sending
+        try:
+            try:
+                family, _, _, _, address = socket.getaddrinfo(
+                    self.host, self.port, type=socket.SOCK_DGRAM
+                )[0]
+            except OSError as e:
+                log.error(f"Failed to resolve '{self.host}': {e}")
+                return
+            first = self.address is None
+            with self._lock:
+                if self.closed is True:
+                    return
+                try:
+                    if family != self.family:
+                        sock = socket.socket(family, socket.SOCK_DGRAM)
+                        sock.connect(address)
+                        old, self._sock = self._sock, sock
+                        self.family = family
+                        if old is not None:
+                            old.close()
+                    else:
+                        self._sock.connect(address)
+                except OSError as e:
+                    log.error(f"Failed to connect to '{self.host}': {e}")
+                    return
+                if address != self.address:
+                    self.sockaddr = _sockaddr(family, address)
+                    self.address = address
+                if self._failing is False:
+                    self._resolve_at = time.monotonic() + self.resolve_interval
+        finally:
+            self._resolving = False
+        if first is True and self.on_resolved is not None:
+            self.on_resolved()
+
+    def send(self, packet):
+        """Send a packet, a list of bytes-like objects."""
+        if self.closed:
+            return
+        if self._custom_sock:
+            address = (self.host, self.port)
+            if hasattr(self._sock, "sendmsg"):
+                size = self._sock.sendmsg(packet, [], 0, address)
+            else:
+                size = self._sock.sendto(b"".join(packet), address)
+            self.sent(size)
+            return
+
+        if self.resolve() is False:
+            return
+        sock = self._sock
+        if sock is None:
+            # Closed since
+            return
+        try:
+            if hasattr(sock, "sendmsg"):
+                size = sock.sendmsg(packet)
+            else:
+                size = sock.send(b"".join(packet))
+        except OSError as e:
+            self.failed(e)
+            return
+        self.sent(size)
+
+    def sent(self, size):
+        """Record that a packet of size bytes was sent."""
+        self.packets += 1
+        self.bytes += size
+        # Errors such as a refused connection are reported by the send after
+        # the one that caused them, so sends keep succeeding in between
+        if (
+            self._failing is True
+            and time.monotonic() - self._failed_at >= self.RETRY_INTERVAL
+        ):
+            self.recovered()
+
+    def failed(self, error):
+        """Record that a send failed, e.g. because the controller is offline,
+        so the host is resolved again before the next send.
+        """
+        self.errors += 1
+        self._failed_at = time.monotonic()
+        if self._failing is False:
+            log.warning(f"Failed to send to '{self.host}': {error}")
+            self._failing = True
+            self._resolve_at = 0
+
+    def recovered(self):
+        self._failing = False
+        self._resolve_at = time.monotonic() + self.resolve_interval
+
+    @property
+    def batchable(self):
+        """Whether packets for this connection can be sent in a Batch."""
+        return (
+            Batch.supported
+            and self._custom_sock is False
+            and self.family == socket.AF_INET
+        )
+
+    def close(self):
+        """Close the socket. The connection can't be used again."""
+        with self._lock:
+            self.closed = True
+            if self._sock is not None and self._custom_sock is False:
+                self._sock.close()
+                self._sock = None
+                self.family = self.address = self.sockaddr = None
+
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_ushort),
+        ("sin_addr", ctypes.c_ubyte * 4),
+        ("sin_zero", ctypes.c_ubyte * 8),
+    ]
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _sockaddr(family, address):
+    if family != socket.AF_INET:
+        return None
+    sockaddr = _sockaddr_in()
+    sockaddr.sin_family = family
+    sockaddr.sin_port = socket.htons(address[1])
+    sockaddr.sin_addr[:] = socket.inet_aton(address[0])
+    return sockaddr
+
+
+def _load_sendmmsg():
+    # The structures above match the Linux ABI only
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.c_uint,
+        ctypes.c_int,
+    ]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def _address_of(buffer, keep):
+    """Return the address of a bytes-like object's data, appending whatever
+    must be kept alive while the address is in use to keep.
+    """
+    if isinstance(buffer, bytes):
+        data = ctypes.c_char_p(buffer)
+    elif isinstance(buffer, memoryview) and buffer.readonly:
+        data = ctypes.c_char_p(bytes(buffer))
+    else:
+        data = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+    keep.append(data)
+    return ctypes.cast(data, ctypes.c_void_p).value
+
+
+class Batch:
+    """Packets for several connections, sent together.
+
+    Packets for batchable connections are sent from one shared socket in a
+    single sendmmsg() call (or as few as errors allow). Anything else is sent
+    by its connection as usual.
+    """
+
+    supported = _sendmmsg is not None
+    _sock = None
+    _sock_lock = Lock()
+
+    def __init__(self):
+        self._messages = []
+
+    def add(self, connection, packets):
+        if connection.resolve() is False or connection.batchable is False:
+            for packet in packets:
+                connection.send(packet)
+            return
+        for packet in packets:
+            self._messages.append((connection, packet))
+
+    def __len__(self):
+        return len(self._messages)
+
+    def send(self):
+        """Send every packet added, then empty the batch."""
+        # Connections closed since their packets were added are skipped
+        messages = [
+            (connection, packet, connection.sockaddr)
+            for connection, packet in self._messages
+            if connection.sockaddr is not None
+        ]
+        self._messages = []
+        if not messages:
+            return
+
+        with Batch._sock_lock:
+            if Batch._sock is None:
+                Batch._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        keep = []
+        headers = (_mmsghdr * len(messages))()
+        for header, (connection, packet, sockaddr) in zip(headers, messages):
+            iov = (_iovec * len(packet))()
+            for vector, buffer in zip(iov, packet):
+                vector.iov_base = _address_of(buffer, keep)
+                vector.iov_len = len(buffer)
+            keep.append(iov)
+            keep.append(sockaddr)
+            header.msg_hdr.msg_name = ctypes.addressof(sockaddr)
+            header.msg_hdr.msg_namelen = ctypes.sizeof(sockaddr)
+            header.msg_hdr.msg_iov = iov
+            header.msg_hdr.msg_iovlen = len(packet)
+
+        fd = Batch._sock.fileno()
+        sent = 0
+        while sent < len(messages):
+            result = _sendmmsg(
+                fd,
+                ctypes.addressof(headers) + sent * ctypes.sizeof(_mmsghdr),
+                len(messages) - sent,
+                0,
+            )
+            if result < 0:
+                # The first unsent message failed, skip it
+                errno = ctypes.get_errno()
+                messages[sent][0].failed(OSError(errno, os.strerror(errno)))
+                sent += 1
+            else:
+                for idx in range(sent, sent + result):
+                    messages[idx][0].sent(headers[idx].msg_len)
+                sent += result
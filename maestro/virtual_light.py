@@ -0,0 +1,74 @@
+from light import Light, NullSink
+
+
+class Segment:
+    """A contiguous run of LEDs on a physical light."""
+
+    def __init__(self, light, start, length):
+        self.light = light
+        self.start = start
+        self.length = length
+
+
+class VirtualLight(Light):
+    """A light made up of segments of one or more physical lights.
+
+    A virtual light can cover part of a physical light (so one strip can be
+    split into independently animated zones) or join several physical lights
+    end to end (so one animation can run across them). Animations draw into
+    the virtual light's own frame buffer as usual. Updating it copies each
+    segment into the frame buffer of its physical light, which is then sent
+    by the flusher at most once per frame period, however many of its
+    segments changed.
+    """
+
+    def __init__(
+        self,
+        segments,
+        flusher,
+        animation_fps=30,
+        engine=None,
+        brightness=1,
+        gamma=1,
+        white_balance=(1, 1, 1),
+        min_fps=None,
+        layout=None,
+    ):
+        super().__init__(
+            None,
+            None,
+            sum(segment.length for segment in segments),
+            animation_fps,
+            engine=engine,
+            brightness=brightness,
+            gamma=gamma,
+            white_balance=white_balance,
+            min_fps=min_fps,
+            layout=layout,
+            # Virtual lights never send anything themselves
+            sock=NullSink(),
+        )
+        self.segments = segments
+        self.flusher = flusher
+
+    def update(self, force=False, batch=None):
+        """Copy the frame buffer into the physical lights and request that
+        they are sent. Returns True if anything was copied. Batches are
+        ignored as the lights are sent by the flusher.
+        """
+        if self._closed is True:
+            return False
+        if force is False and self._is_dirty() is False:
+            return False
+        _, pixels = self._output_frame()
+
+        start = 0
+        for segment in self.segments:
+            end = start + segment.length
+            with segment.light._lock:
+                segment.light.set_pixels(
+                    pixels[start * 3 : end * 3], segment.start
+                )
+            self.flusher.request(segment.light, force)
+            start = end
+        return True
@@ -0,0 +1,325 @@
+"""Rendering animations in worker processes.
+
+Every animation normally runs in the maestro process, so CPU heavy animations
+on many lights compete for one interpreter. With a WorkerPool, animations are
+instead run by one of several worker processes, each with its own
+interpreter. In the maestro process a RemoteAnimation stands in for each one.
+
+A worker renders each frame into a shared memory buffer, which the maestro
+process copies into the light, so frames are never pickled. Only small
+control messages pass between the processes: starting and stopping
+animations, and requests for the next frame with the time elapsed.
+
+Frames are pipelined. While the maestro process sends a frame, the worker
+renders the next one. If the next frame isn't ready by the time it is due,
+the light shows the previous frame again and the time elapsed is carried
+over to the following request.
+"""
+
+import itertools
+import multiprocessing
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import animations
+import palettes
+from animations.animation_interface import AnimationInterface
+from light import Light, NullSink
+from logger import log
+
+
+class WorkerPool:
+    """A pool of worker processes that animations can be run in.
+
+    If heavy_only is True, only animations marked as cpu_heavy are run in
+    the pool. The palettes from the config (see palettes.configure()) are
+    registered in each worker. A worker whose process has died is restarted
+    when the next animation is created.
+    """
+
+    def __init__(
+        self, processes, plugin_dir=None, palette_configs=None, heavy_only=True
+    ):
+        self.heavy_only = heavy_only
+        # Spawned rather than forked, as the maestro process runs threads
+        self._context = multiprocessing.get_context("spawn")
+        self._plugin_dir = plugin_dir
+        self._palette_configs = palette_configs or {}
+        self._workers = [self._create_worker(idx) for idx in range(processes)]
+        self._job_ids = itertools.count()
+
+    def _create_worker(self, idx):
+        return _Worker(
+            self._context, idx, self._plugin_dir, self._palette_configs
+        )
+
+    def __len__(self):
+        return len(self._workers)
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        for worker in self._workers:
+            worker.stop()
+
+    def set_palettes(self, palette_configs):
+        """Register the palettes from a new config in every worker."""
+        self._palette_configs = palette_configs
+        for worker in self._workers:
+            try:
+                worker.send(("palettes", None, palette_configs))
+            except OSError:
+                # A dead worker is restarted with the new palettes
+                pass
+
+    def accepts(self, Animation):
+        """Whether an animation class should be run in the pool."""
+        return self.heavy_only is False or Animation.cpu_heavy is True
+
+    def create(self, animation_name, light, config):
+        """Start an animation on the worker running the fewest animations.
+        Returns the RemoteAnimation standing in for it. Raises an OSError if
+        the animation can't be sent to the worker.
+        """
+        for idx, worker in enumerate(self._workers):
+            if worker.alive is False:
+                log.warning(f"Restarting render process {idx}")
+                worker = self._workers[idx] = self._create_worker(idx)
+                worker.start()
+        worker = min(self._workers, key=lambda worker: len(worker.jobs))
+        return RemoteAnimation(
+            worker, next(self._job_ids), animation_name, light, config
+        )
+
+
+class _Worker:
+    """The maestro side of a worker process."""
+
+    def __init__(self, context, idx, plugin_dir, palette_configs):
+        self.idx = idx
+        self.jobs = {}
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_run_worker,
+            args=(child_conn, plugin_dir, palette_configs),
+            name=f"maestro-render-{idx}",
+            daemon=True,
+        )
+        self._send_lock = threading.Lock()
+        self._stopping = False
+        self._exited = False
+
+    def start(self):
+        self._process.start()
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def stop(self):
+        self._stopping = True
+        for job in list(self.jobs.values()):
+            job.stop()
+        try:
+            self.send(None)
+        except OSError:
+            pass
+        self._process.join(timeout=5)
+
+    @property
+    def alive(self):
+        """Whether the worker process is still running."""
+        return self._exited is False and self._process.is_alive()
+
+    def send(self, message):
+        """Send a message to the worker process. Raises an OSError if it
+        has exited.
+        """
+        with self._send_lock:
+            self._conn.send(message)
+
+    def _receive(self):
+        while True:
+            try:
+                kind, job_id, value = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == "frame":
+                job.reply = (value, None)
+            else:
+                job.reply = (True, value)
+
+        self._exited = True
+        if self._stopping is False:
+            log.error(f"Render process {self.idx} exited")
+        for job in list(self.jobs.values()):
+            job.reply = (True, "Render process exited")
+
+
+class RemoteAnimation(AnimationInterface):
+    """Stands in for an animation running in a worker process."""
+
+    def __init__(self, worker, job_id, animation_name, light, config):
+        self.light = light
+        self._worker = worker
+        self._job_id = job_id
+        # Reported as a local animation's would be
+        self._name = animations.get(animation_name).__name__
+        self._size = len(light.pixels)
+        # Set by the worker's receiving thread once a frame has been
+        # rendered: whether the animation finished, and an error if it
+        # failed
+        self.reply = None
+        # Time elapsed since the last frame was requested
+        self._elapsed = 0
+
+        # The shared memory starts with the light's current frame, as some
+        # animations start from the LEDs' current colours
+        self._shm = shared_memory.SharedMemory(create=True, size=self._size)
+        self._shm.buf[: self._size] = light.pixels
+        worker.jobs[job_id] = self
+        try:
+            worker.send(
+                (
+                    "start",
+                    job_id,
+                    (
+                        animation_name,
+                        config,
+                        light.num_leds,
+                        light.animation_fps,
+                        light.layout,
+                        self._shm.name,
+                    ),
+                )
+            )
+        except OSError as e:
+            self.stop()
+            raise OSError(
+                f"Failed to start '{animation_name}' in render process "
+                f"{worker.idx}: {e}"
+            ) from e
+
+    def advance(self, elapsed):
+        self._elapsed += elapsed
+        reply = self.reply
+        if reply is None:
+            # The next frame isn't ready yet
+            return False
+        self.reply = None
+
+        finished, error = reply
+        if error is not None:
+            raise RuntimeError(f"Failed in render process:\n{error}")
+        self.light.set_pixels(self._shm.buf[: self._size])
+        if finished is True:
+            return True
+        try:
+            self._worker.send(("advance", self._job_id, self._elapsed))
+        except OSError as e:
+            raise RuntimeError(
+                f"Failed to send to render process {self._worker.idx}: {e}"
+            ) from e
+        self._elapsed = 0
+        return False
+
+    def stop(self):
+        if self._worker.jobs.pop(self._job_id, None) is None:
+            return
+        try:
+            self._worker.send(("stop", self._job_id, None))
+        except OSError:
+            # The worker has exited, taking the animation with it
+            pass
+        self._shm.close()
+        self._shm.unlink()
+
+    @property
+    def name(self):
+        return self._name
+
+
+class _Job:
+    """An animation running in a worker process."""
+
+    def __init__(self, animation, light, shm):
+        self.animation = animation
+        self.light = light
+        self.shm = shm
+
+    def render(self, elapsed):
+        finished = self.animation.advance(elapsed) is True
+        self.shm.buf[: len(self.light.pixels)] = self.light.pixels
+        return finished
+
+    def close(self):
+        try:
+            self.animation.stop()
+        finally:
+            self.shm.close()
+
+
+def _start_job(message):
+    animation_name, config, num_leds, fps, layout, shm_name = message
+    shm = shared_memory.SharedMemory(shm_name)
+    try:
+        light = Light(
+            None, None, num_leds, fps, layout=layout, sock=NullSink()
+        )
+        light.set_pixels(shm.buf[: num_leds * 3])
+        animation = animations.get(animation_name)(light, config)
+    except Exception:
+        shm.close()
+        raise
+    return _Job(animation, light, shm)
+
+
+def _run_worker(conn, plugin_dir, palette_configs):
+    """The main loop of a worker process."""
+    animations.discover_plugins(plugin_dir)
+    palettes.configure(palette_configs)
+    jobs = {}
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        kind, job_id, value = message
+
+        if kind == "palettes":
+            palettes.configure(value)
+            continue
+
+        if kind == "stop":
+            job = jobs.pop(job_id, None)
+            if job is not None:
+                job.close()
+            continue
+
+        try:
+            if kind == "start":
+                job = jobs[job_id] = _start_job(value)
+                elapsed = 1 / job.light.animation_fps
+            else:
+                job = jobs.get(job_id)
+                if job is None:
+                    continue
+                elapsed = value
+            finished = job.render(elapsed)
+        except Exception:
+            job = jobs.pop(job_id, None)
+            if job is not None:
+                job.close()
+            conn.send(("failed", job_id, traceback.format_exc()))
+            continue
+        if finished is True:
+            jobs.pop(job_id).close()
+        conn.send(("frame", job_id, finished))
+
+    for job in jobs.values():
+        job.close()